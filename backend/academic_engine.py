@@ -5,15 +5,24 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from rag import clear_rag
+from rag import set_active_collection
 
+# Generate study material, flashcards and the study plan in one Granite call
+# (one copy of the scraped content instead of three); "0" restores per-artifact calls.
+COMBINED_GENERATION = os.environ.get("ACADEMIC_COMBINED_GENERATION", "1") != "0"
+
+
+async def _as_result(value):
+    """Wrap an already-available artifact so it can sit in the same gather as real calls."""
+    return value
 
 
 async def run_academic_flow(query: str, ws_broadcast, course_name: str = ""):
     """Full academic flow: Canvas -> scrape -> generate study material -> send to frontend."""
     course_label = course_name.strip() if course_name.strip() else "CSE 3244"
     try:
-        clear_rag()
+        # Search and ingest only this course's material; other courses stay warm
+        set_active_collection(course_label)
         await ws_broadcast(json.dumps({"type": "status", "text": "Accessing Canvas..."}))
         await ws_broadcast(json.dumps({
             "type": "thought",
@@ -36,8 +45,16 @@ async def run_academic_flow(query: str, ws_broadcast, course_name: str = ""):
             "text": "Sending scraped content to GPT-4o for concept extraction and quiz generation..."
         }))
 
-        from quiz_generator import generate_study_material
-        material = await generate_study_material(scraped_content, query)
+        # One combined call for material, cards and plan; anything that fails
+        # validation is regenerated below by its own per-artifact call
+        bundle = {}
+        if COMBINED_GENERATION:
+            from quiz_generator import generate_study_bundle
+            bundle = await generate_study_bundle(scraped_content, query)
+        material = bundle.get("material")
+        if not material:
+            from quiz_generator import generate_study_material
+            material = await generate_study_material(scraped_content, query)
 
         if not material:
             await ws_broadcast(json.dumps({
@@ -67,19 +84,28 @@ async def run_academic_flow(query: str, ws_broadcast, course_name: str = ""):
         # Auto-generate flashcards, OSU resources, and study plan IN PARALLEL
         try:
             from study_mode_manager import generate_anki_cards, find_osu_study_resources
-            from rag import add_to_rag
-            from watsonx_client import wx_json as _wx_json
+            from rag import ingest_in_background
+            from llm_scheduler import BACKGROUND, llm_priority
+            from structured_output import STUDY_STEPS, wx_structured
             import json as _json
             import os as _os
 
-            # Kick off RAG embedding in background (doesn't need to block cards)
-            asyncio.create_task(add_to_rag(scraped_content, material["course_name"]))
+            # Kick off RAG embedding in background (doesn't need to block cards);
+            # batches become searchable as they land
+            ingest_in_background(scraped_content, material["course_name"], source="canvas_scrape")
 
             await ws_broadcast(json.dumps({"type": "thought", "text": "Generating flashcards and study plan in parallel..."}))
 
             async def _make_study_plan():
                 try:
                     _subject = material["course_name"]
+                    if bundle.get("plan"):
+                        await ws_broadcast(_json.dumps({
+                            "type": "study_plan",
+                            "steps": bundle["plan"],
+                            "subject": _subject,
+                        }))
+                        return
                     _prompt = f"""You are a study coach. Based on the following lecture material for {_subject}, create a concise, actionable 5-step study plan.
 
 Lecture material:
@@ -87,25 +113,25 @@ Lecture material:
 
 Return ONLY a JSON object with key "steps" containing an array of exactly 5 steps, each with "step" (1-5) and "text" (one sentence, max 20 words, actionable):
 {{"steps": [{{"step": 1, "text": "..."}}, ...]}}"""
-                    _raw = await _wx_json(_prompt)
-                    _parsed = _json.loads(_raw)
-                    _steps = _parsed.get("steps", [])
+                    _steps = await wx_structured(_prompt, STUDY_STEPS, "academic_study_plan")
                     if _steps:
                         await ws_broadcast(_json.dumps({
                             "type": "study_plan",
-                            "steps": _steps[:5],
+                            "steps": _steps,
                             "subject": _subject,
                         }))
                 except Exception as _e:
                     print(f"Study plan generation error: {_e}")
 
-            # Run all three concurrently
-            cards, resources, _ = await asyncio.gather(
-                generate_anki_cards(scraped_content[:8000], material["course_name"]),
-                find_osu_study_resources(material["course_name"]),
-                _make_study_plan(),
-                return_exceptions=True,
-            )
+            # Run all three concurrently, behind any interactive question at the provider
+            with llm_priority(BACKGROUND):
+                cards, resources, _ = await asyncio.gather(
+                    _as_result(bundle["cards"]) if bundle.get("cards")
+                    else generate_anki_cards(scraped_content[:8000], material["course_name"]),
+                    find_osu_study_resources(material["course_name"]),
+                    _make_study_plan(),
+                    return_exceptions=True,
+                )
 
             if isinstance(cards, list) and cards:
                 await ws_broadcast(json.dumps({
@@ -273,7 +299,7 @@ async def scrape_canvas(query: str, ws_broadcast, course_label: str = "CSE 3244"
             page = await browser_session.get_current_page()
             try:
                 import pdfplumber
-                from rag import add_to_rag
+                from rag import ingest_in_background
 
                 os.makedirs("./uploads", exist_ok=True)
 
@@ -346,13 +372,15 @@ async def scrape_canvas(query: str, ws_broadcast, course_label: str = "CSE 3244"
                             for p in pdf.pages:
                                 t = p.extract_text()
                                 if t:
-                                    pdf_text += t + "\n"
+                                    # Form feed marks the page break for the RAG chunker
+                                    pdf_text += t + "\n\f"
                     except Exception as parse_err:
                         return ActionResult(extracted_content=f"Saved '{save_name}' ({len(body)} bytes) but PDF parse failed: {parse_err}")
 
                 if pdf_text.strip():
-                    await add_to_rag(pdf_text, filename)
-                    return ActionResult(extracted_content=f"Downloaded '{save_name}' — extracted {len(pdf_text)} chars and added to knowledge base.")
+                    # Embed in the background so the agent can move on to the next file
+                    ingest_in_background(pdf_text, filename, source="canvas_file")
+                    return ActionResult(extracted_content=f"Downloaded '{save_name}' — extracted {len(pdf_text)} chars and queued it for the knowledge base.")
                 else:
                     return ActionResult(extracted_content=f"Saved '{save_name}' ({len(body)} bytes). No text extracted (may be image-based PDF).")
 
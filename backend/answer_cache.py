@@ -0,0 +1,97 @@
+"""
+answer_cache.py -- Semantic cache of study Q&A answers.
+
+Students ask the same thing many ways ("what is CAP", "explain the CAP
+theorem"). Each answer is stored with the question embedding and the ids
+(plus a text fingerprint) of the chunks it was grounded on. A new question
+within ANSWER_CACHE_THRESHOLD cosine similarity of a cached one, in the
+same scope, is answered from the cache -- but only while those source
+chunks are still in the index unchanged.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.environ.get("RAG_ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", "0.92"))
+
+
+class AnswerCache:
+    """
+    Bounded LRU of (scope, unit question embedding) -> (answer, sources).
+
+    `scope` is any string that must match exactly (collection name plus
+    retrieval filters); `sources` is an opaque list the caller validates.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray | None:
+        q = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        return q / norm if norm else None
+
+    def get(self, scope: str, embedding, is_valid=None) -> dict | None:
+        """
+        Best cached entry for the question, or None. is_valid(sources) is
+        called on a candidate; entries whose sources changed are dropped.
+        """
+        q = self._unit(embedding)
+        keys = [k for k, e in self._entries.items() if e["scope"] == scope]
+        if q is None or not keys:
+            self.misses += 1
+            return None
+        scores = np.stack([self._entries[k]["embedding"] for k in keys]) @ q
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        key = keys[best]
+        entry = self._entries[key]
+        if is_valid is not None and not is_valid(entry["sources"]):
+            del self._entries[key]
+            self.stale += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry, similarity=float(scores[best]))
+
+    def put(self, scope: str, embedding, answer: str, sources: list) -> None:
+        q = self._unit(embedding)
+        if q is None:
+            return
+        self._entries[self._next_key] = {"scope": scope, "embedding": q, "answer": answer, "sources": sources}
+        self._next_key += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,177 @@
+"""
+chunker.py -- Structure-aware, token-sized chunking for RAG ingestion.
+
+Text is first cut into sections at PDF page breaks (form feeds), slide/page
+markers and headings, then small neighbouring sections are packed together
+and long ones are split on paragraph, line and sentence boundaries. Chunk
+size is measured in tiktoken tokens (cl100k_base, the text-embedding-3
+tokenizer); overlap only applies inside a section that had to be split.
+"""
+import os
+import re
+
+CHUNK_TOKENS = int(os.environ.get("RAG_CHUNK_TOKENS", "350"))
+CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", "40"))
+
+_HEADING = re.compile(
+    r"^\s*(?:#{1,6}\s+\S"                  # markdown heading
+    r"|(?:slide|page|lecture|chapter)\s+\d+\b"  # slide / page markers
+    r"|(?:\d+\.)+\d*\s+[A-Z]"              # numbered heading: "2.1 Consistency"
+    r")",
+    re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; fall back to a char estimate if it is unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"[Chunker] tiktoken unavailable ({e}) -- estimating tokens from length")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc is None:
+        return -(-len(text) // 4)  # ceil, so estimates of parts never undercount the whole
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, preferring to end on a line break."""
+    enc = _get_encoding()
+    if enc is None:
+        if count_tokens(text) <= max_tokens:
+            return text
+        cut = text[: max_tokens * 4]
+    else:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = enc.decode(tokens[:max_tokens])
+    newline = cut.rfind("\n")
+    return cut[:newline] if newline > len(cut) // 2 else cut
+
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80:
+        return False
+    if _HEADING.match(stripped):
+        return True
+    # Short ALL-CAPS lines are slide titles in most exported decks
+    letters = [c for c in stripped if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def split_sections(text: str) -> list[str]:
+    """Split at page breaks and before heading lines. Empty sections are dropped."""
+    sections: list[str] = []
+    for page in text.split("\f"):
+        current: list[str] = []
+        for line in page.split("\n"):
+            if _is_heading(line) and any(l.strip() for l in current):
+                sections.append("\n".join(current).strip())
+                current = []
+            current.append(line)
+        if any(l.strip() for l in current):
+            sections.append("\n".join(current).strip())
+    return [s for s in sections if s]
+
+
+def _units(section: str, max_tokens: int) -> list[tuple[str, int, str]]:
+    """
+    Break a section into (text, tokens, separator) units no larger than
+    max_tokens. The separator is what joins the unit to the one before it.
+    """
+    units: list[tuple[str, int, str]] = []
+    for para in re.split(r"\n\s*\n", section):
+        for line in para.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            n = count_tokens(line)
+            if n <= max_tokens:
+                units.append((line, n, "\n"))
+                continue
+            sep = "\n"
+            for sentence in _SENTENCE_END.split(line):
+                n = count_tokens(sentence)
+                pieces = [(sentence, n)] if n <= max_tokens else _hard_split(sentence, max_tokens)
+                for piece, pn in pieces:
+                    units.append((piece, pn, sep))
+                    sep = " "
+    return units
+
+
+def _hard_split(text: str, max_tokens: int) -> list[tuple[str, int]]:
+    """Last resort for a single run-on sentence: cut on token windows."""
+    enc = _get_encoding()
+    if enc is None:
+        width = max_tokens * 4
+        return [(text[i:i + width], count_tokens(text[i:i + width])) for i in range(0, len(text), width)]
+    tokens = enc.encode(text, disallowed_special=())
+    return [(enc.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens]))
+            for i in range(0, len(tokens), max_tokens)]
+
+
+def _join(units: list[tuple[str, int, str]]) -> str:
+    return "".join((sep if i else "") + text for i, (text, _, sep) in enumerate(units))
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> list[str]:
+    """
+    Return chunks of at most ~max_tokens tokens that never cut a line or
+    sentence mid-way. Whole sections are packed together while they fit.
+    """
+    chunks: list[str] = []
+    pending: list[str] = []
+    pending_tokens = 0
+
+    def flush():
+        nonlocal pending, pending_tokens
+        if pending:
+            chunks.append("\n\n".join(pending))
+        pending, pending_tokens = [], 0
+
+    for section in split_sections(text):
+        tokens = count_tokens(section)
+        if tokens <= max_tokens:
+            if pending_tokens + tokens > max_tokens:
+                flush()
+            pending.append(section)
+            pending_tokens += tokens
+            continue
+
+        # Oversized section: split on unit boundaries, overlapping the tail of each window
+        flush()
+        window: list[tuple[str, int, str]] = []
+        window_tokens = 0
+        for unit in _units(section, max_tokens):
+            n = unit[1]
+            if window and window_tokens + n > max_tokens:
+                chunks.append(_join(window))
+                carried: list[tuple[str, int, str]] = []
+                carried_tokens = 0
+                for prev in reversed(window):
+                    if carried_tokens + prev[1] > overlap_tokens or carried_tokens + prev[1] + n > max_tokens:
+                        break
+                    carried.insert(0, prev)
+                    carried_tokens += prev[1]
+                window, window_tokens = carried, carried_tokens
+            window.append(unit)
+            window_tokens += n
+        if window:
+            chunks.append(_join(window))
+
+    flush()
+    return chunks
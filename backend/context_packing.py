@@ -0,0 +1,71 @@
+"""
+context_packing.py -- Diverse result selection and token-budgeted prompt context.
+
+Overlapping chunks make neighbouring results near-identical. mmr_select()
+re-ranks a candidate pool with maximal marginal relevance and drops near
+duplicates; pack_context() then fills a caller's token budget with the
+highest-value chunks, so the LLM sees more distinct material per prompt.
+"""
+import numpy as np
+
+from chunker import count_tokens
+
+MMR_LAMBDA = 0.7
+DUPLICATE_SIMILARITY = 0.95
+SEPARATOR = "\n\n---\n\n"
+
+
+def mmr_select(relevance: list[float], vectors: np.ndarray, k: int,
+               lambda_: float = MMR_LAMBDA,
+               duplicate_similarity: float = DUPLICATE_SIMILARITY) -> list[int]:
+    """
+    Pick up to k candidate positions balancing relevance against redundancy.
+
+    relevance: one score per candidate (any scale; min-max normalized here)
+    vectors:   unit-normalized candidate embeddings, one row per candidate
+    Candidates whose cosine similarity to an already selected one exceeds
+    duplicate_similarity are suppressed outright.
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    rel = np.asarray(relevance, dtype=np.float32)
+    spread = rel.max() - rel.min()
+    rel = (rel - rel.min()) / spread if spread > 0 else np.ones(n, dtype=np.float32)
+    sims = vectors @ vectors.T
+
+    selected: list[int] = []
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    while len(selected) < k and available.any():
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        mmr = lambda_ * rel - (1 - lambda_) * redundancy
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, sims[best])
+        available &= max_sim < duplicate_similarity
+    return selected
+
+
+def format_hit(hit: dict) -> str:
+    return f"Source: {hit['title']}\n{hit['text']}"
+
+
+def pack_context(hits: list[dict], token_budget: int) -> str:
+    """
+    Join hits (already in priority order) into prompt context, keeping every
+    hit that still fits the token budget and skipping ones that do not.
+    """
+    parts: list[str] = []
+    used = 0
+    sep_tokens = count_tokens(SEPARATOR)
+    for hit in hits:
+        block = format_hit(hit)
+        cost = count_tokens(block) + (sep_tokens if parts else 0)
+        if used + cost > token_budget:
+            continue
+        parts.append(block)
+        used += cost
+    return SEPARATOR.join(parts)
@@ -0,0 +1,70 @@
+"""
+embedding_cache.py -- In-process LRU cache of text embeddings.
+
+Keys are (model, sha256 of whitespace-normalized text), so the same slide
+text reaching add_to_rag from a Canvas download, the scraped-content
+ingestion and a repeat session costs one embedding call instead of three.
+"""
+import hashlib
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class EmbeddingCache:
+    """Bounded LRU map of (model, text hash) -> float32 vector with hit/miss counters."""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.requests_saved = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> tuple[str, str]:
+        return model, hashlib.sha256(_normalize(text).encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        k = self.key(model, text)
+        vector = self._entries.get(k)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(k)
+        self.hits += 1
+        return vector
+
+    def put(self, model: str, text: str, vector) -> None:
+        k = self.key(model, text)
+        self._entries[k] = np.asarray(vector, dtype=np.float32)
+        self._entries.move_to_end(k)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "requests_saved": self.requests_saved,
+        }
@@ -0,0 +1,84 @@
+"""
+lexical_index.py -- In-memory BM25 inverted index over RAG chunks.
+
+Row ids match the VectorIndex rows in rag.py, so lexical and vector rankings
+can be fused. Scoring needs no network call, which makes it the fallback
+retriever when the embedding API is slow or unavailable.
+"""
+import heapq
+import math
+import re
+from collections import Counter
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or "
+    "that the this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase alphanumeric terms with common English stopwords removed."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class LexicalIndex:
+    """Okapi BM25 with postings stored as term -> {row_id: term_frequency}."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[int, int]] = {}
+        self._doc_lens: list[int] = []
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lens)
+
+    def add(self, texts: list[str]) -> list[int]:
+        """Index texts under the next sequential row ids. Returns those ids."""
+        ids = []
+        for text in texts:
+            row = len(self._doc_lens)
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[row] = tf
+            length = sum(terms.values())
+            self._doc_lens.append(length)
+            self._total_len += length
+            ids.append(row)
+        return ids
+
+    def search(self, query: str, top_k: int = 5, rows=None) -> list[tuple[int, float]]:
+        """
+        Return up to top_k (row_id, bm25_score) pairs with score > 0, best first.
+        `rows` restricts scoring to those row ids (statistics stay corpus-wide).
+        """
+        n = len(self._doc_lens)
+        if n == 0 or top_k <= 0:
+            return []
+        avg_len = self._total_len / n or 1.0
+        allowed = set(int(r) for r in rows) if rows is not None else None
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for row, tf in postings.items():
+                if allowed is not None and row not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lens[row] / avg_len)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+
+    def memory_bytes(self) -> int:
+        """Rough estimate: ~80 bytes per posting entry plus per-term overhead."""
+        postings = sum(len(p) for p in self._postings.values())
+        return 80 * postings + 120 * len(self._postings) + 8 * len(self._doc_lens)
+
+    def clear(self) -> None:
+        self._postings = {}
+        self._doc_lens = []
+        self._total_len = 0
@@ -0,0 +1,216 @@
+"""
+llm_resilience.py -- Shared retry / hedging layer for LLM and embedding calls.
+
+Each remote endpoint (watsonx generation, Orchestrate chat, OpenAI chat and
+embeddings) gets an Endpoint that runs calls through tenacity with:
+
+  - retries only on transient failures: 408/409/429/5xx and transport errors
+  - full-jitter exponential backoff that waits at least as long as the
+    server's Retry-After header asks
+  - a per-endpoint retry budget: every call deposits RETRY_BUDGET_RATIO of
+    a retry token (capped), and each retry spends one, so an outage cannot
+    multiply traffic by the attempt count
+  - optional hedging: when a call runs past the endpoint's observed p95
+    latency, one duplicate is sent and whichever finishes first wins
+
+Calls are passed as zero-argument coroutine factories, so every attempt
+(and hedge) re-enters the provider scheduler on its own.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+import numpy as np
+from tenacity import AsyncRetrying, stop_after_attempt
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRY_AFTER_MAX = 60.0
+RETRY_BUDGET_RATIO = float(os.environ.get("LLM_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MAX = 10.0
+HEDGE_MIN_SAMPLES = 20
+_LATENCY_SAMPLES = 200
+
+
+def _status_code(exc: BaseException) -> int | None:
+    """HTTP status of an httpx or OpenAI SDK error, if it carries one."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(exc, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Connection resets, DNS hiccups and timeouts (httpx, and the OpenAI SDK's wrappers of them)
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError)) or type(exc).__name__ in (
+        "APIConnectionError", "APITimeoutError",
+    )
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date)."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """Token bucket filled by calls and drained by retries."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, cap: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+
+    def deposit(self) -> None:
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Endpoint:
+    """Retry policy, retry budget and latency tracking for one remote endpoint."""
+
+    def __init__(self, name: str, max_attempts: int = 4, hedge: bool = False):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.budget = RetryBudget()
+        self._latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def p95(self) -> float | None:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self._latencies, 95))
+
+    def _should_retry(self, retry_state) -> bool:
+        if not retry_state.outcome.failed:
+            return False
+        exc = retry_state.outcome.exception()
+        if retry_state.attempt_number >= self.max_attempts or not is_retryable(exc):
+            return False
+        if not self.budget.withdraw():
+            self.retries_denied += 1
+            print(f"[resilience] {self.name}: retry budget exhausted -- giving up on {type(exc).__name__}")
+            return False
+        self.retries += 1
+        return True
+
+    @staticmethod
+    def _wait(retry_state) -> float:
+        """Full-jitter exponential backoff, but never shorter than Retry-After."""
+        backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry_state.attempt_number))
+        requested = retry_after(retry_state.outcome.exception()) or 0.0
+        return max(backoff, min(requested, RETRY_AFTER_MAX))
+
+    def _before_sleep(self, retry_state) -> None:
+        exc = retry_state.outcome.exception()
+        status = _status_code(exc)
+        print(f"[resilience] {self.name}: attempt {retry_state.attempt_number} failed "
+              f"({status or type(exc).__name__}) -- retrying in {retry_state.next_action.sleep:.1f}s")
+
+    async def _timed(self, factory):
+        started = time.perf_counter()
+        result = await factory()
+        self._latencies.append(time.perf_counter() - started)
+        return result
+
+    async def _hedged(self, factory):
+        """Run factory; if it outlives the p95 latency, race one duplicate against it."""
+        threshold = self.p95()
+        first = asyncio.ensure_future(self._timed(factory))
+        if threshold is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=threshold)
+        if done or not self.budget.withdraw():
+            return await first
+        self.hedges += 1
+        second = asyncio.ensure_future(self._timed(factory))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both failed: surface the original request's error
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, factory, hedge: bool | None = None):
+        """Await factory() with retries (and hedging if enabled). Re-raises the last error."""
+        self.calls += 1
+        self.budget.deposit()
+        use_hedge = self.hedge if hedge is None else hedge
+        try:
+            async for attempt in AsyncRetrying(
+                stop=stop_after_attempt(self.max_attempts),
+                wait=self._wait,
+                retry=self._should_retry,
+                before_sleep=self._before_sleep,
+                reraise=True,
+            ):
+                with attempt:
+                    return await (self._hedged(factory) if use_hedge else self._timed(factory))
+        except Exception:
+            self.failures += 1
+            raise
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "retries_denied": self.retries_denied,
+            "retry_budget": round(self.budget.tokens, 2),
+            "hedging": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+_endpoints: dict[str, Endpoint] = {}
+
+
+def get_endpoint(name: str, max_attempts: int = 4, hedge: bool = False) -> Endpoint:
+    """Shared Endpoint for a name; settings apply on first use."""
+    endpoint = _endpoints.get(name)
+    if endpoint is None:
+        endpoint = _endpoints[name] = Endpoint(name, max_attempts, hedge)
+    return endpoint
+
+
+def resilience_stats() -> dict:
+    return {name: e.stats() for name, e in _endpoints.items()}
@@ -0,0 +1,190 @@
+"""
+llm_scheduler.py -- Priority-aware admission control in front of LLM providers.
+
+Every watsonx generation and OpenAI call takes a slot from its provider's
+scheduler first. A slot needs both a free concurrency permit and a token
+from the provider's token bucket. Waiters are admitted by priority class,
+so a student's study_qa question goes ahead of the flashcards, study plan
+and embeddings a flow fired in the background:
+
+  INTERACTIVE  -- a user is waiting on this reply
+  FOREGROUND   -- the main step of a flow the user just started (default)
+  BACKGROUND   -- prefetch / side work (ingestion, parallel extras)
+
+The class is carried in a context variable, so wrapping a block in
+`with llm_priority(BACKGROUND):` also covers tasks created inside it.
+Waiters age one class per PRIORITY_AGING_SECONDS so background work is
+never starved outright. Queue-wait times are recorded per class.
+
+Provider limits (env):
+  WATSONX_MAX_CONCURRENCY / WATSONX_RATE_PER_SEC  (default 4 / 8)
+  OPENAI_MAX_CONCURRENCY  / OPENAI_RATE_PER_SEC   (default 8 / 50)
+"""
+import asyncio
+import contextvars
+import os
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import numpy as np
+
+INTERACTIVE = 0
+FOREGROUND = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", FOREGROUND: "foreground", BACKGROUND: "background"}
+
+PRIORITY_AGING_SECONDS = float(os.environ.get("LLM_PRIORITY_AGING_SECONDS", "15"))
+_WAIT_SAMPLES = 1000
+
+PROVIDER_LIMITS = {
+    "watsonx": (
+        int(os.environ.get("WATSONX_MAX_CONCURRENCY", "4")),
+        float(os.environ.get("WATSONX_RATE_PER_SEC", "8")),
+    ),
+    "openai": (
+        int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8")),
+        float(os.environ.get("OPENAI_RATE_PER_SEC", "50")),
+    ),
+}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=FOREGROUND)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """Run a block (and tasks it creates) at the given priority class."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class _Waiter:
+    __slots__ = ("priority", "enqueued", "future")
+
+    def __init__(self, priority: int, future: asyncio.Future):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.future = future
+
+    def effective_priority(self, now: float) -> float:
+        return self.priority - (now - self.enqueued) / PRIORITY_AGING_SECONDS
+
+
+class ProviderScheduler:
+    """Concurrency cap plus token bucket for one provider, admitting waiters by priority."""
+
+    def __init__(self, name: str, max_concurrency: int, rate_per_sec: float, burst: float | None = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst or max(1.0, rate_per_sec)
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._waiters: list[_Waiter] = []
+        self._wake: asyncio.TimerHandle | None = None
+        self._waits: dict[int, deque] = {p: deque(maxlen=_WAIT_SAMPLES) for p in PRIORITY_NAMES}
+        self._admitted: dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_sec > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_per_sec)
+        else:
+            self._tokens = self.burst
+        self._refilled = now
+
+    def _dispatch(self) -> None:
+        """Admit the best waiters while permits and tokens allow; otherwise arm a refill timer."""
+        self._wake = None
+        self._waiters = [w for w in self._waiters if not w.future.done()]
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and self._active < self.max_concurrency:
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate_per_sec
+                self._wake = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            best = min(self._waiters, key=lambda w: (w.effective_priority(now), w.enqueued))
+            self._waiters.remove(best)
+            self._tokens -= 1
+            self._active += 1
+            best.future.set_result(now - best.enqueued)
+
+    async def _acquire(self, priority: int) -> float:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(_Waiter(priority, future))
+        if self._wake is None:
+            self._dispatch()
+        try:
+            waited = await future
+        except asyncio.CancelledError:
+            # Admitted just as the caller was cancelled: hand the permit back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self._waits[priority].append(waited)
+        self._admitted[priority] += 1
+        return waited
+
+    def _release(self) -> None:
+        self._active -= 1
+        if self._wake is None:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int | None = None):
+        """Hold one admission for the duration of a provider call. Yields the seconds spent queued."""
+        waited = await self._acquire(current_priority() if priority is None else priority)
+        try:
+            yield waited
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        classes = {}
+        for p, name in PRIORITY_NAMES.items():
+            waits = np.array(self._waits[p]) * 1000 if self._waits[p] else None
+            classes[name] = {
+                "admitted": self._admitted[p],
+                "queued": sum(1 for w in self._waiters if w.priority == p and not w.future.done()),
+                "wait_p50_ms": round(float(np.percentile(waits, 50)), 1) if waits is not None else 0.0,
+                "wait_p95_ms": round(float(np.percentile(waits, 95)), 1) if waits is not None else 0.0,
+                "wait_max_ms": round(float(waits.max()), 1) if waits is not None else 0.0,
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate_per_sec": self.rate_per_sec,
+            "active": self._active,
+            "classes": classes,
+        }
+
+
+# Schedulers hold loop-bound futures, so each event loop gets its own set
+# (the sync LangChain wrapper runs calls on a separate short-lived loop).
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, ProviderScheduler]]" = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(provider: str) -> ProviderScheduler:
+    """The running loop's scheduler for a provider ("watsonx" or "openai")."""
+    per_loop = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    scheduler = per_loop.get(provider)
+    if scheduler is None:
+        max_concurrency, rate = PROVIDER_LIMITS[provider]
+        scheduler = per_loop[provider] = ProviderScheduler(provider, max_concurrency, rate)
+    return scheduler
+
+
+def scheduler_stats() -> dict:
+    try:
+        per_loop = _schedulers.get(asyncio.get_running_loop(), {})
+    except RuntimeError:
+        per_loop = {}
+    return {name: s.stats() for name, s in per_loop.items()}
@@ -0,0 +1,263 @@
+"""
+llm_usage.py -- Per-call-site token, latency and cost accounting.
+
+Every upstream model request (watsonx generation, Orchestrate chat, OpenAI
+chat and embeddings, Deepgram transcription) is recorded with the call
+site that issued it, its prompt / completion tokens, the time it queued in
+the provider scheduler, the upstream latency and an estimated cost.
+
+Call sites are carried in a context variable, like llm_priority:
+
+    with llm_call_site("anki_cards"):
+        cards = await wx_json(...)
+
+and each provider call is wrapped in track_call() inside its scheduler slot:
+
+    async with get_scheduler("openai").slot() as queued:
+        with track_call("openai", "gpt-4o", queued) as call:
+            response = await client.chat.completions.create(...)
+            call.tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+
+Recent calls live in an in-memory ring (percentiles); totals are rolled up
+per (day, site, provider, model) into llm_usage.db next to sayam.db,
+written in batches rather than once per call.
+
+Prices (USD per 1M input / output tokens) can be overridden with
+LLM_PRICES='{"model-id": [input, output]}'.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from database import DB_FILENAME
+
+USAGE_DB = os.path.join(os.path.dirname(os.path.abspath(DB_FILENAME)), "llm_usage.db")
+USAGE_RING_SIZE = int(os.environ.get("LLM_USAGE_RING_SIZE", "5000"))
+USAGE_FLUSH_CALLS = 20
+USAGE_FLUSH_SECONDS = 60.0
+UNLABELED = "unlabeled"
+
+MODEL_PRICES = {
+    "ibm/granite-3-3-8b-instruct": (0.20, 0.20),
+    "gpt-4o": (2.50, 10.00),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("LLM_PRICES", "{}")).items()})
+
+_call_site: contextvars.ContextVar[str | None] = contextvars.ContextVar("llm_call_site", default=None)
+
+
+@contextmanager
+def llm_call_site(name: str):
+    """Attribute model calls made in a block (and tasks it creates) to a call site."""
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+
+def current_call_site() -> str | None:
+    return _call_site.get()
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+class _Call:
+    __slots__ = ("prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def tokens(self, prompt: int | None, completion: int | None = 0) -> None:
+        self.prompt_tokens = prompt or 0
+        self.completion_tokens = completion or 0
+
+    def openai_usage(self, response) -> None:
+        """Token counts from an OpenAI SDK response's .usage, if present."""
+        usage = getattr(response, "usage", None)
+        self.tokens(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+
+
+class UsageLedger:
+    """In-memory ring of recent calls plus a batched SQLite rollup of totals."""
+
+    def __init__(self, db_path: str = USAGE_DB, ring_size: int = USAGE_RING_SIZE):
+        self.db_path = db_path
+        self._ring: deque = deque(maxlen=ring_size)
+        self._pending: dict[tuple, list] = {}
+        self._pending_calls = 0
+        self._flushed_at = time.monotonic()
+        # The sync LangChain wrapper records from a worker thread
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        if not self._initialized:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                day               TEXT NOT NULL,
+                site              TEXT NOT NULL,
+                provider          TEXT NOT NULL,
+                model             TEXT NOT NULL,
+                calls             INTEGER NOT NULL DEFAULT 0,
+                errors            INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cost_usd          REAL NOT NULL DEFAULT 0,
+                latency_ms        REAL NOT NULL DEFAULT 0,
+                queue_ms          REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, site, provider, model)
+            )
+            ''')
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def record(self, site: str, provider: str, model: str, ok: bool, prompt_tokens: int,
+               completion_tokens: int, queue_ms: float, latency_ms: float) -> None:
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        now = time.time()
+        self._ring.append((now, site, provider, model, ok, prompt_tokens, completion_tokens,
+                           queue_ms, latency_ms, cost))
+        key = (time.strftime("%Y-%m-%d", time.gmtime(now)), site, provider, model)
+        with self._lock:
+            row = self._pending.setdefault(key, [0, 0, 0, 0, 0.0, 0.0, 0.0])
+            for i, v in enumerate((1, int(not ok), prompt_tokens, completion_tokens, cost, latency_ms, queue_ms)):
+                row[i] += v
+            self._pending_calls += 1
+            due = (self._pending_calls >= USAGE_FLUSH_CALLS
+                   or time.monotonic() - self._flushed_at >= USAGE_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write pending totals to the rollup table."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_calls = 0
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT INTO llm_usage_daily (day, site, provider, model, calls, errors, prompt_tokens, "
+                "completion_tokens, cost_usd, latency_ms, queue_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, site, provider, model) DO UPDATE SET "
+                "calls = calls + excluded.calls, errors = errors + excluded.errors, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "cost_usd = cost_usd + excluded.cost_usd, latency_ms = latency_ms + excluded.latency_ms, "
+                "queue_ms = queue_ms + excluded.queue_ms",
+                [(*key, *row) for key, row in pending.items()],
+            )
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"[usage] Rollup write failed: {e}")
+
+    def recent(self) -> dict:
+        """Per-site percentiles and sums over the in-memory ring."""
+        by_site: dict[str, list] = {}
+        for entry in list(self._ring):
+            by_site.setdefault(entry[1], []).append(entry)
+        out = {}
+        for site, entries in sorted(by_site.items()):
+            latency = np.array([e[8] for e in entries])
+            queue = np.array([e[7] for e in entries])
+            out[site] = {
+                "calls": len(entries),
+                "errors": sum(1 for e in entries if not e[4]),
+                "providers": sorted({f"{e[2]}:{e[3]}" for e in entries}),
+                "prompt_tokens": sum(e[5] for e in entries),
+                "completion_tokens": sum(e[6] for e in entries),
+                "cost_usd": round(sum(e[9] for e in entries), 6),
+                "latency_p50_ms": round(float(np.percentile(latency, 50)), 1),
+                "latency_p95_ms": round(float(np.percentile(latency, 95)), 1),
+                "latency_p99_ms": round(float(np.percentile(latency, 99)), 1),
+                "queue_p50_ms": round(float(np.percentile(queue, 50)), 1),
+                "queue_p95_ms": round(float(np.percentile(queue, 95)), 1),
+            }
+        return out
+
+    def totals(self, days: int = 7) -> dict:
+        """Per-site totals from the rollup table over the last `days` days (UTC)."""
+        self.flush()
+        since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - max(0, days - 1) * 86400))
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT site, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens), "
+            "SUM(cost_usd), SUM(latency_ms), SUM(queue_ms) FROM llm_usage_daily "
+            "WHERE day >= ? GROUP BY site ORDER BY SUM(cost_usd) DESC",
+            (since,),
+        ).fetchall()
+        conn.close()
+        return {
+            site: {
+                "calls": calls,
+                "errors": errors,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_usd": round(cost, 6),
+                "latency_avg_ms": round(latency / calls, 1) if calls else 0.0,
+                "queue_avg_ms": round(queue / calls, 1) if calls else 0.0,
+            }
+            for site, calls, errors, prompt_tokens, completion_tokens, cost, latency, queue in rows
+        }
+
+
+_ledger: UsageLedger | None = None
+
+
+def _get_ledger() -> UsageLedger:
+    global _ledger
+    if _ledger is None:
+        _ledger = UsageLedger()
+    return _ledger
+
+
+@contextmanager
+def track_call(provider: str, model: str, queued: float | None = 0.0, site: str | None = None):
+    """
+    Time one upstream request and record it under the current call site.
+    `queued` is the scheduler wait in seconds (what slot() yields). Failed
+    requests are recorded as errors and the exception re-raised.
+    """
+    call = _Call()
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield call
+        ok = True
+    finally:
+        try:
+            _get_ledger().record(
+                site or current_call_site() or UNLABELED, provider, model, ok,
+                call.prompt_tokens, call.completion_tokens,
+                (queued or 0.0) * 1000, (time.perf_counter() - started) * 1000,
+            )
+        except Exception as e:
+            print(f"[usage] Failed to record {provider} call: {e}")
+
+
+def flush_usage() -> None:
+    if _ledger is not None:
+        _ledger.flush()
+
+
+def usage_stats(days: int = 7) -> dict:
+    ledger = _get_ledger()
+    return {"recent": ledger.recent(), "totals": ledger.totals(days), "days": days}
@@ -5,7 +5,11 @@ import pdfplumber
 import io
 import os
 import asyncio
-from watsonx_client import wx_chat, wx_json
+import uuid
+from contextlib import asynccontextmanager
+from watsonx_client import wx_chat_stream
+from llm_scheduler import INTERACTIVE, llm_priority
+from llm_usage import llm_call_site
 from orchestrate_client import orchestrate_chat, is_configured as orchestrate_configured
 from dotenv import load_dotenv
 from database import (
@@ -19,13 +23,23 @@ from database import (
 
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
-app = FastAPI(title="Sayam Backend")
-
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    from rag import set_progress_listener
+    set_progress_listener(_send_rag_progress)
     from ngrok_manager import start_ngrok_and_register_webhook
     await start_ngrok_and_register_webhook()
+    from watsonx_client import close_http_client, start_token_refresher, stop_token_refresher
+    start_token_refresher()
+    yield
+    # Stop IAM renewal and release pooled keep-alive connections to IBM Cloud
+    await stop_token_refresher()
+    await close_http_client()
+    from llm_usage import flush_usage
+    flush_usage()
+
+app = FastAPI(title="Sayam Backend", lifespan=lifespan)
 
 from sms_handler import sms_router
 app.include_router(sms_router)
@@ -54,6 +68,13 @@ async def ws_send(message: str):
         except Exception:
             active_ws = None
 
+async def _send_rag_progress(progress: dict):
+    """Forward RAG ingestion progress (docs/chunks pending) to the desktop UI."""
+    await ws_send(json.dumps({"type": "rag_progress", **progress}))
+
+# Token budget for retrieved course material pasted into tutor / study-plan prompts
+RAG_CONTEXT_TOKENS = 1500
+
 # Conversation history per session (in-memory, single-user demo)
 _conversation_history: list[dict] = []
 
@@ -89,6 +110,41 @@ async def update_profile_endpoint(request: Request):
 def job_applications_endpoint():
     return get_job_applications()
 
+@app.get("/rag/stats")
+def rag_stats_endpoint():
+    from rag import get_rag_stats
+    return get_rag_stats()
+
+@app.get("/llm/cache/stats")
+def llm_cache_stats_endpoint():
+    from watsonx_client import response_cache_stats
+    return response_cache_stats()
+
+@app.get("/llm/scheduler/stats")
+async def llm_scheduler_stats_endpoint():
+    from llm_scheduler import scheduler_stats
+    return scheduler_stats()
+
+@app.get("/llm/resilience/stats")
+def llm_resilience_stats_endpoint():
+    from llm_resilience import resilience_stats
+    return resilience_stats()
+
+@app.get("/llm/coalescing/stats")
+def llm_coalescing_stats_endpoint():
+    from single_flight import coalescing_stats
+    return coalescing_stats()
+
+@app.get("/llm/structured/stats")
+def llm_structured_stats_endpoint():
+    from structured_output import structured_stats
+    return structured_stats()
+
+@app.get("/llm/usage/stats")
+def llm_usage_stats_endpoint(days: int = 7):
+    from llm_usage import usage_stats
+    return usage_stats(days)
+
 @app.patch("/job-applications/{app_id}/status")
 async def update_application_status(app_id: int, request: Request):
     data = await request.json()
@@ -134,13 +190,11 @@ Resume text:
 Return only this JSON structure:
 {{"name": "", "email": "", "phone": null, "gpa": null, "location": "", "university": null, "graduation_year": null, "skills": [], "target_roles": []}}"""
 
-    response_text = await wx_chat(prompt)
-    raw = response_text.replace("```json", "").replace("```", "").strip()
-
+    from structured_output import RESUME_PROFILE, StructuredOutputError, wx_structured
     try:
-        extracted_data = json.loads(raw)
-    except json.JSONDecodeError:
-        return {"status": "error", "message": "Failed to parse extracted resume data.", "raw": raw}
+        extracted_data = await wx_structured(prompt, RESUME_PROFILE, "resume_profile", max_tokens=768)
+    except StructuredOutputError as e:
+        return {"status": "error", "message": "Failed to parse extracted resume data.", "raw": e.raw}
 
     extracted_data["resume_base_text"] = text
     extracted_data["resume_pdf_path"] = pdf_path
@@ -192,7 +246,8 @@ async def lecture_session_qa(session_id: int, request: Request):
     if not session:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Session not found")
-    answer = await answer_question(question, session.get("notes", ""), session.get("transcript", ""))
+    with llm_priority(INTERACTIVE):
+        answer = await answer_question(question, session.get("notes", ""), session.get("transcript", ""))
     return {"answer": answer}
 
 
@@ -204,7 +259,7 @@ async def update_session_title(session_id: int, request: Request):
 
 
 @app.post("/lecture-sessions/{session_id}/flashcards")
-async def flashcards_from_session(session_id: int):
+async def flashcards_from_session(session_id: int, regenerate: bool = False):
     from study_mode_manager import generate_anki_cards
     from fastapi import HTTPException
     session = get_lecture_session(session_id)
@@ -212,12 +267,12 @@ async def flashcards_from_session(session_id: int):
         raise HTTPException(status_code=404, detail="Session not found")
     content = session.get("notes") or session.get("transcript") or ""
     title = session.get("title") or ""
-    cards = await generate_anki_cards(content, title)
+    cards = await generate_anki_cards(content, title, regenerate=regenerate)
     return {"cards": cards}
 
 
 @app.post("/lecture-sessions/{session_id}/quiz")
-async def quiz_from_session(session_id: int):
+async def quiz_from_session(session_id: int, regenerate: bool = False):
     from quiz_generator import generate_study_material
     from fastapi import HTTPException
     session = get_lecture_session(session_id)
@@ -225,7 +280,7 @@ async def quiz_from_session(session_id: int):
         raise HTTPException(status_code=404, detail="Session not found")
     content = session.get("notes") or session.get("transcript") or ""
     title = session.get("title") or ""
-    result = await generate_study_material(content, title)
+    result = await generate_study_material(content, title, regenerate=regenerate)
     if not result:
         raise HTTPException(status_code=500, detail="Failed to generate quiz from notes")
     return result
@@ -306,7 +361,9 @@ async def websocket_endpoint(websocket: WebSocket):
                 if msg_type == "study_qa":
                     question = msg.get("text", "")
                     context = msg.get("context", "")
-                    asyncio.create_task(handle_study_qa(question, context))
+                    # The student is waiting on this answer: jump ahead of background LLM work
+                    with llm_priority(INTERACTIVE), llm_call_site("study_qa"):
+                        asyncio.create_task(handle_study_qa(question, context, *_rag_filters(msg)))
                     continue
 
                 if msg_type == "start_study_session":
@@ -325,7 +382,8 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     # Route through IBM watsonx Orchestrate (falls back to Granite if unconfigured)
                     try:
-                        orc = await orchestrate_chat(text, _conversation_history)
+                        with llm_priority(INTERACTIVE):
+                            orc = await orchestrate_chat(text, _conversation_history)
                         intent = orc.get("intent", "general")
                         orc_reply = orc.get("reply", "")
                     except Exception as _orc_err:
@@ -547,19 +605,36 @@ async def handle_study_mode_activate(query: str):
     }))
 
 
+def _rag_filters(msg: dict) -> tuple[dict | None, dict | None]:
+    """Optional RAG metadata filters from a client message, e.g. include_titles: ["Lecture 5"]."""
+    include = {}
+    if msg.get("include_titles"):
+        include["title"] = msg["include_titles"]
+    if msg.get("source"):
+        include["source"] = msg["source"]
+    exclude = {"title": msg["exclude_titles"]} if msg.get("exclude_titles") else {}
+    return include or None, exclude or None
+
+
 async def handle_generate_cards(msg: dict):
     """Generate Anki flashcards from RAG store (downloaded PDFs) + current page text."""
     from study_mode_manager import generate_anki_cards
-    from rag import query_rag, storage as rag_storage
+    from rag import query_rag_many, rag_chunk_count, ingest_progress
     page_text = msg.get("page_text", "").strip()
     subject = msg.get("subject", "")
-
-    # 1. Try RAG first — this contains all the Canvas PDFs the agent downloaded
-    rag_content = ""
-    if rag_storage:
-        rag_content = await query_rag(
-            f"key concepts, definitions, and topics for {subject} exam" if subject else "important concepts",
-            top_k=8
+    include, exclude = _rag_filters(msg)
+
+    # 1. Try RAG first — this contains all the Canvas PDFs the agent downloaded.
+    # The study-plan context is retrieved in the same batch so it costs no extra round trip.
+    rag_content = plan_content = ""
+    if rag_chunk_count() or ingest_progress()["docs_pending"]:
+        rag_content, plan_content = await query_rag_many(
+            [
+                f"key concepts, definitions, and topics for {subject} exam" if subject else "important concepts",
+                f"learning objectives and major topics to review for {subject}" if subject else "learning objectives and major topics",
+            ],
+            top_k=12, wait_for="*", wait_timeout=4.0, token_budget=RAG_CONTEXT_TOKENS,
+            include=include, exclude=exclude,
         )
 
     # 2. Combine RAG + live page text (RAG takes priority, page text fills gaps)
@@ -580,7 +655,7 @@ async def handle_generate_cards(msg: dict):
         return
 
     await ws_send(json.dumps({"type": "thought", "text": f"Generating flashcards from {'lecture slides + RAG' if rag_content else 'current page'}..."}))
-    cards = await generate_anki_cards(combined, subject)
+    cards = await generate_anki_cards(combined, subject, regenerate=bool(msg.get("regenerate")))
 
     if not cards:
         await ws_send(json.dumps({
@@ -597,54 +672,86 @@ async def handle_generate_cards(msg: dict):
 
     # 3. Also generate a dynamic study plan if we have RAG content
     if rag_content.strip():
-        asyncio.create_task(handle_generate_study_plan(combined, subject))
+        asyncio.create_task(handle_generate_study_plan(plan_content or combined, subject))
 
 
 async def handle_generate_study_plan(content: str, subject: str):
     """Generate an AI study plan from lecture content and broadcast it."""
+    from chunker import truncate_to_tokens
+    from structured_output import STUDY_STEPS, wx_structured
     try:
         subject_hint = f' for **{subject}**' if subject else ''
         prompt = f"""You are a study coach. Based on the following lecture material{subject_hint}, create a concise, actionable 5-step study plan the student should follow to prepare for their exam.
 
 Lecture material:
-{content[:6000]}
+{truncate_to_tokens(content, RAG_CONTEXT_TOKENS)}
 
 Return ONLY a JSON array of exactly 5 steps, each with "step" (1-5) and "text" (one sentence, max 20 words, actionable):
 [{{"step": 1, "text": "..."}}, ...]"""
 
-        raw = await wx_json(prompt)
-        parsed = json.loads(raw)
-        steps = []
-        if isinstance(parsed, list):
-            steps = parsed
-        elif isinstance(parsed, dict):
-            for v in parsed.values():
-                if isinstance(v, list):
-                    steps = v
-                    break
+        steps = await wx_structured(prompt, STUDY_STEPS, "lecture_study_plan")
 
         if steps:
             await ws_send(json.dumps({
                 "type": "study_plan",
-                "steps": steps[:5],
+                "steps": steps,
                 "subject": subject,
             }))
     except Exception as e:
         print(f"Study plan generation error: {e}")
 
 
-async def handle_study_qa(question: str, context: str):
-    from rag import query_rag
+async def handle_study_qa(question: str, context: str,
+                          include: dict | None = None, exclude: dict | None = None):
+    from rag import embed_question, format_context, lookup_answer, remember_answer, search_rag, wait_until_ready
+    from chunker import truncate_to_tokens
     try:
-        rag_context = await query_rag(question, top_k=5)
+        # Embedded once for the answer cache, the search and remember_answer;
+        # if it fails, skip the cache and search with BM25 alone
+        q_emb = await embed_question(question)
+        if q_emb is not None:
+            # Rephrasings of an earlier question are answered from the semantic cache
+            cached = await lookup_answer(question, include=include, exclude=exclude, embedding=q_emb)
+            if cached is not None:
+                await ws_send(json.dumps({
+                    "type": "study_qa_response",
+                    "text": cached,
+                    "cached": True,
+                }))
+                return
+
+        # Slides may still be embedding right after the study panel opens
+        await wait_until_ready(timeout=4.0)
+        try:
+            hits = await search_rag(question, top_k=8, mode="hybrid" if q_emb is not None else "lexical",
+                                    include=include, exclude=exclude, embedding=q_emb)
+        except Exception as e:
+            print(f"Error querying RAG: {e}")
+            hits = []
+        rag_context = format_context(hits, RAG_CONTEXT_TOKENS)
         # Fallback to the default scraped context if RAG has no data
-        final_context = rag_context if rag_context.strip() else context[:6000]
+        final_context = rag_context if rag_context.strip() else truncate_to_tokens(context, RAG_CONTEXT_TOKENS)
         
-        answer = await wx_chat(question, system=f"You are a helpful tutor. Use the following course material to answer the student's question. Be concise but thorough.\n\nCourse Material:\n{final_context}")
+        # Stream the answer: deltas share a stream_id, and a final done frame carries the full text
+        stream_id = uuid.uuid4().hex
+        parts: list[str] = []
+        async for delta in wx_chat_stream(question, system=f"You are a helpful tutor. Use the following course material to answer the student's question. Be concise but thorough.\n\nCourse Material:\n{final_context}"):
+            parts.append(delta)
+            await ws_send(json.dumps({
+                "type": "study_qa_response",
+                "stream_id": stream_id,
+                "delta": delta,
+                "done": False,
+            }))
+        answer = "".join(parts).strip()
         await ws_send(json.dumps({
             "type": "study_qa_response",
+            "stream_id": stream_id,
             "text": answer,
+            "done": True,
         }))
+        if q_emb is not None:
+            await remember_answer(question, answer, hits, include=include, exclude=exclude, embedding=q_emb)
     except Exception as e:
         await ws_send(json.dumps({
             "type": "study_qa_response",
@@ -0,0 +1,66 @@
+"""
+metadata_index.py -- Row-id postings over chunk metadata for filtered retrieval.
+
+Each RagCollection keeps one of these beside its vector and BM25 indexes.
+Include/exclude filters resolve to a candidate row-id array before any
+scoring, so restricting a question to one lecture also makes it cheaper.
+"""
+import numpy as np
+
+FILTER_FIELDS = ("title", "course", "source")
+
+
+class MetadataIndex:
+    """field -> value -> row ids, for the fields in FILTER_FIELDS."""
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, list[int]]] = {f: {} for f in FILTER_FIELDS}
+        self._size = 0
+
+    def add(self, payloads: list[dict]) -> None:
+        for payload in payloads:
+            for field in FILTER_FIELDS:
+                value = payload.get(field)
+                if value is not None:
+                    self._postings[field].setdefault(str(value), []).append(self._size)
+            self._size += 1
+
+    def values(self, field: str) -> list[str]:
+        return sorted(self._postings.get(field, {}))
+
+    def _matching_rows(self, field: str, wanted) -> set[int]:
+        """Rows whose value contains any wanted string (case-insensitive)."""
+        if field not in self._postings:
+            raise ValueError(f"cannot filter on {field!r}; use one of {FILTER_FIELDS}")
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        needles = [w.lower() for w in wanted if w]
+        rows: set[int] = set()
+        for value, ids in self._postings[field].items():
+            if any(n in value.lower() for n in needles):
+                rows.update(ids)
+        return rows
+
+    def resolve(self, include: dict | None = None, exclude: dict | None = None) -> np.ndarray | None:
+        """
+        Candidate row ids for the filters, or None when no filter applies.
+        Values within a field are OR-ed; include fields are AND-ed.
+        """
+        if not include and not exclude:
+            return None
+        allowed: set[int] | None = None
+        for field, wanted in (include or {}).items():
+            rows = self._matching_rows(field, wanted)
+            allowed = rows if allowed is None else allowed & rows
+        if allowed is None:
+            allowed = set(range(self._size))
+        for field, unwanted in (exclude or {}).items():
+            allowed -= self._matching_rows(field, unwanted)
+        return np.fromiter(sorted(allowed), dtype=np.int64, count=len(allowed))
+
+    def memory_bytes(self) -> int:
+        return 36 * self._size * len(FILTER_FIELDS)
+
+    def clear(self) -> None:
+        self._postings = {f: {} for f in FILTER_FIELDS}
+        self._size = 0
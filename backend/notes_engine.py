@@ -9,6 +9,11 @@ import os
 import httpx
 import openai
 
+from llm_resilience import get_endpoint
+from llm_scheduler import get_scheduler
+from llm_usage import track_call
+from single_flight import coalesce, request_key
+
 
 async def transcribe_audio(audio_bytes: bytes, mimetype: str) -> str:
     """
@@ -20,21 +25,22 @@ async def transcribe_audio(audio_bytes: bytes, mimetype: str) -> str:
     content_type = mimetype or "audio/webm"
 
     async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(
-            "https://api.deepgram.com/v1/listen",
-            headers={
-                "Authorization": f"Token {api_key}",
-                "Content-Type": content_type,
-            },
-            params={
-                "model": "nova-2",
-                "smart_format": "true",
-                "punctuate": "true",
-            },
-            content=audio_bytes,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+        with track_call("deepgram", "nova-2", site="lecture_transcribe"):
+            resp = await client.post(
+                "https://api.deepgram.com/v1/listen",
+                headers={
+                    "Authorization": f"Token {api_key}",
+                    "Content-Type": content_type,
+                },
+                params={
+                    "model": "nova-2",
+                    "smart_format": "true",
+                    "punctuate": "true",
+                },
+                content=audio_bytes,
+            )
+            resp.raise_for_status()
+            data = resp.json()
 
     channels = data.get("results", {}).get("channels", [])
     if not channels:
@@ -48,28 +54,36 @@ async def generate_notes(transcript: str, title: str) -> str:
     Ask GPT-4o to generate clean, organized markdown notes from a transcript.
     Returns a markdown string.
     """
-    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are a lecture note-taking assistant. Given a lecture transcript, produce clean organized notes in markdown with:\n"
-                    "1. A short **Summary** paragraph (2–3 sentences).\n"
-                    "2. **Key Concepts** — bold headings (##) for each concept with bullet points underneath.\n"
-                    "3. **Important Terms/Definitions** — a brief glossary at the end if applicable.\n"
-                    "Be concise. Use markdown headings, bold, and bullet points."
-                ),
-            },
-            {
-                "role": "user",
-                "content": f"Lecture title: {title}\n\nTranscript:\n{transcript[:8000]}",
-            },
-        ],
-        temperature=0.3,
-    )
+    async def _attempt():
+        async with get_scheduler("openai").slot() as queued:
+            with track_call("openai", "gpt-4o", queued, site="lecture_notes") as call:
+                response = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": (
+                                "You are a lecture note-taking assistant. Given a lecture transcript, produce clean organized notes in markdown with:\n"
+                                "1. A short **Summary** paragraph (2–3 sentences).\n"
+                                "2. **Key Concepts** — bold headings (##) for each concept with bullet points underneath.\n"
+                                "3. **Important Terms/Definitions** — a brief glossary at the end if applicable.\n"
+                                "Be concise. Use markdown headings, bold, and bullet points."
+                            ),
+                        },
+                        {
+                            "role": "user",
+                            "content": f"Lecture title: {title}\n\nTranscript:\n{transcript[:8000]}",
+                        },
+                    ],
+                    temperature=0.3,
+                )
+                call.openai_usage(response)
+                return response
+
+    key = request_key("gpt-4o", "notes", title, transcript[:8000])
+    response = await coalesce("openai.chat", key, lambda: get_endpoint("openai.chat").call(_attempt))
     return response.choices[0].message.content.strip()
 
 
@@ -78,7 +92,7 @@ async def answer_question(question: str, notes: str, transcript: str) -> str:
     Answer a follow-up question using the session's notes as primary context.
     Falls back to the raw transcript if notes are empty.
     """
-    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 
     context = notes if notes and notes.strip() else transcript[:6000]
     supplement = transcript[:3000] if notes and notes.strip() else ""
@@ -91,12 +105,20 @@ async def answer_question(question: str, notes: str, transcript: str) -> str:
     if supplement:
         system_content += f"\n\n## Raw Transcript (supplemental):\n{supplement}"
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": question},
-        ],
-        temperature=0.4,
-    )
+    async def _attempt():
+        async with get_scheduler("openai").slot() as queued:
+            with track_call("openai", "gpt-4o", queued, site="lecture_qa") as call:
+                response = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": system_content},
+                        {"role": "user", "content": question},
+                    ],
+                    temperature=0.4,
+                )
+                call.openai_usage(response)
+                return response
+
+    key = request_key("gpt-4o", "answer", system_content, question)
+    response = await coalesce("openai.chat", key, lambda: get_endpoint("openai.chat").call(_attempt))
     return response.choices[0].message.content.strip()
@@ -14,8 +14,9 @@ The Orchestrate endpoint format:
 """
 
 import os
-import httpx
-from watsonx_client import _get_iam_token   # reuse the shared IAM token cache
+from llm_resilience import get_endpoint
+from llm_usage import llm_call_site, track_call
+from watsonx_client import _get_iam_token, get_http_client   # shared IAM token cache + connection pool
 
 _ORC_URL = os.environ.get("IBM_ORCHESTRATE_URL", "").rstrip("/")
 _ORC_INSTANCE = os.environ.get("IBM_ORCHESTRATE_INSTANCE_ID", "")
@@ -50,6 +51,11 @@ async def orchestrate_chat(user_message: str, conversation_history: list[dict] |
 
     Falls back to watsonx.ai (Granite) if Orchestrate credentials are not configured.
     """
+    with llm_call_site("orchestrate_routing"):
+        return await _orchestrate_chat(user_message, conversation_history)
+
+
+async def _orchestrate_chat(user_message: str, conversation_history: list[dict] | None) -> dict:
     if not _ORC_URL or not _ORC_INSTANCE:
         # Fallback to watsonx.ai Granite for intent classification
         return await _granite_fallback(user_message, conversation_history)
@@ -63,21 +69,29 @@ async def orchestrate_chat(user_message: str, conversation_history: list[dict] |
         token = await _get_iam_token()
         url = f"{_ORC_URL}/instances/{_ORC_INSTANCE}/v1/chat/completions"
 
-        async with httpx.AsyncClient(timeout=30) as c:
-            r = await c.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "messages": messages,
-                    "temperature": 0.2,
-                    "max_tokens": 300,
-                },
-            )
-            r.raise_for_status()
-            data = r.json()
+        async def _attempt() -> dict:
+            with track_call("orchestrate", "orchestrate-chat") as call:
+                r = await get_http_client().post(
+                    url,
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Content-Type": "application/json",
+                    },
+                    json={
+                        "messages": messages,
+                        "temperature": 0.2,
+                        "max_tokens": 300,
+                    },
+                    timeout=30,
+                )
+                r.raise_for_status()
+                data = r.json()
+                usage = data.get("usage") or {}
+                call.tokens(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            return data
+
+        # Interactive routing: one quick retry, then the Granite fallback below
+        data = await get_endpoint("orchestrate.chat", max_attempts=2).call(_attempt)
 
         # Extract the assistant reply
         raw = data["choices"][0]["message"]["content"].strip()
@@ -1,13 +1,21 @@
-import json
 import os
+from llm_usage import llm_call_site
+from response_cache import TTL_DAY
+from structured_output import (
+    FLASHCARDS, QUIZ_FEEDBACK, STUDY_MATERIAL, STUDY_STEPS, StructuredOutputError,
+    conform, record_outcome, repair_json, wx_structured,
+)
 from watsonx_client import wx_json
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-async def generate_study_material(content: str, query: str) -> dict | None:
-    """Generate concepts + quiz questions from scraped course content using IBM watsonx Granite."""
+async def generate_study_material(content: str, query: str, regenerate: bool = False) -> dict | None:
+    """
+    Generate concepts + quiz questions from scraped course content using IBM watsonx Granite.
+    Identical content and query reuse the cached quiz for a day unless regenerate=True.
+    """
     try:
         prompt = f"""You are an expert tutor. Based on the following course content and the student query, generate comprehensive study material.
 
@@ -20,15 +28,11 @@ Generate a JSON response with this exact structure:
 {{"course_name": "Short course/topic name", "concepts": [{{"title": "Concept Name", "explanation": "2-4 sentence explanation", "key_points": ["point 1", "point 2"]}}], "questions": [{{"id": 1, "text": "Question text", "options": ["A", "B", "C", "D"], "correct_index": 0, "explanation": "Why correct"}}]}}
 
 Rules: 5-8 concepts, exactly 5 questions, 4 options each, correct_index is 0-based."""
-        raw = await wx_json(prompt, max_tokens=1500)
-        material = json.loads(raw)
-
-        # Validate structure
-        if "concepts" not in material or "questions" not in material:
-            return None
+        material = await wx_structured(prompt, STUDY_MATERIAL, "study_material", max_tokens=1500,
+                                       cache_ttl=TTL_DAY, regenerate=regenerate)
 
         # Ensure course_name exists
-        if "course_name" not in material:
+        if not material.get("course_name"):
             material["course_name"] = query.strip().title()
 
         return material
@@ -38,6 +42,79 @@ Rules: 5-8 concepts, exactly 5 questions, 4 options each, correct_index is 0-bas
         return None
 
 
+async def generate_study_bundle(content: str, query: str, regenerate: bool = False) -> dict:
+    """
+    One-pass generation of every academic-flow artifact from a single copy of
+    the content: concepts + quiz questions, flashcards and a 5-step study plan.
+
+    Returns a dict holding only the artifacts that passed validation --
+    "material" (same shape as generate_study_material), "cards" and
+    "plan" -- so callers can fall back to the per-artifact call for anything
+    missing. Returns {} if the combined call fails outright.
+    """
+    try:
+        prompt = f"""You are an expert tutor and study coach. Based on the following course content and the student query, generate a complete study set.
+
+Student query: "{query}"
+
+Course content:
+{content[:8000]}
+
+Generate a JSON response with this exact structure:
+{{"course_name": "Short course/topic name",
+  "concepts": [{{"title": "Concept Name", "explanation": "2-4 sentence explanation", "key_points": ["point 1", "point 2"]}}],
+  "questions": [{{"id": 1, "text": "Question text", "options": ["A", "B", "C", "D"], "correct_index": 0, "explanation": "Why correct"}}],
+  "cards": [{{"front": "What is X?", "back": "X is ..."}}],
+  "plan": [{{"step": 1, "text": "..."}}]}}
+
+Rules: 5-8 concepts, exactly 5 questions, 4 options each, correct_index is 0-based.
+5-8 flashcards: fronts are concise questions or terms (max 15 words), backs are clear self-contained answers (1-3 sentences).
+plan has exactly 5 actionable steps (one sentence, max 20 words each)."""
+        # Only a bundle with every artifact is cached; partial ones are regenerated next time
+        with llm_call_site("study_bundle"):
+            raw = await wx_json(prompt, max_tokens=2800, cache_ttl=TTL_DAY, regenerate=regenerate,
+                                validate=lambda text: len(_parse_bundle(text, query)[0]) == 3)
+    except Exception as e:
+        print(f"Combined study generation error: {e}")
+        return {}
+    # Local repair only: anything unusable falls back to its own call
+    try:
+        bundle, repairs, salvaged = _parse_bundle(raw, query)
+    except StructuredOutputError as e:
+        print(f"Combined study generation error: {e}")
+        record_outcome("study_bundle", [], failed=True)
+        return {}
+    missing = {"material", "cards", "plan"} - bundle.keys()
+    record_outcome("study_bundle", repairs, salvaged=bool(missing) or salvaged)
+    if missing:
+        print(f"Combined study generation: falling back for {', '.join(sorted(missing))}")
+    return bundle
+
+
+def _parse_bundle(raw: str, query: str) -> tuple[dict, list[str], bool]:
+    """Repair a combined reply; return (valid artifacts, repairs, salvaged). Raises StructuredOutputError."""
+    parsed, repairs = repair_json(raw)
+    if not isinstance(parsed, dict):
+        raise StructuredOutputError("study_bundle: expected a JSON object")
+    bundle: dict = {}
+    try:
+        material, salvaged = conform(parsed, STUDY_MATERIAL)
+        bundle["material"] = {
+            "course_name": material.get("course_name") or query.strip().title(),
+            "concepts": material["concepts"],
+            "questions": material["questions"],
+        }
+    except StructuredOutputError:
+        salvaged = True
+    cards = [c for c in parsed.get("cards") or [] if FLASHCARDS.item.valid(c)]
+    if len(cards) >= 3:
+        bundle["cards"] = cards[:8]
+    plan = [s for s in parsed.get("plan") or [] if STUDY_STEPS.item.valid(s) and s["text"]]
+    if len(plan) >= 3:
+        bundle["plan"] = plan[:5]
+    return bundle, repairs, salvaged
+
+
 async def generate_study_plan(concepts: list, wrong_questions: list, course_name: str, score: int, total: int) -> dict:
     """Generate personalized feedback and a 5-day study plan after quiz completion using IBM watsonx Granite."""
     try:
@@ -54,16 +131,17 @@ Questions answered wrong:
 Generate a JSON response: {{"feedback": "2-3 sentence personalized feedback", "study_plan": ["Day 1 task", "Day 2 task", "Day 3 task", "Day 4 task", "Day 5 task"]}}
 
 Rules: feedback honest but encouraging, study_plan EXACTLY 5 items, focus on weak areas, tasks specific and actionable."""
-        raw = await wx_json(prompt, max_tokens=800)
-        result = json.loads(raw)
+        result = await wx_structured(prompt, QUIZ_FEEDBACK, "study_plan", max_tokens=800)
 
-        # Validate and pad study_plan to exactly 5 items
-        plan = result.get("study_plan", [])
+        # Pad study_plan to exactly 5 items
+        plan = result.get("study_plan")
+        if not isinstance(plan, list):
+            plan = []
         while len(plan) < 5:
             plan.append(f"Day {len(plan) + 1}: Review key concepts and practice problems")
         result["study_plan"] = plan[:5]
 
-        if "feedback" not in result:
+        if not isinstance(result.get("feedback"), str):
             result["feedback"] = f"You scored {score}/{total}. Keep reviewing the material and you'll improve!"
 
         return result
@@ -1,63 +1,656 @@
-import math
+import numpy as np
 import openai
 import os
 import asyncio
+import time
+from collections import OrderedDict
 
-storage = []
-
-async def add_to_rag(text: str, title: str):
-    """Chunk text, get embeddings, and store in memory."""
-    global storage
-    # Simple chunking: 1000 chars with 200 overlap
-    chunks = [text[i:i+1000] for i in range(0, len(text), 800)]
-    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    
-    for chunk in chunks:
-        if not chunk.strip():
+from answer_cache import AnswerCache
+from chunker import CHUNK_OVERLAP, CHUNK_TOKENS, chunk_text
+from context_packing import SEPARATOR, format_hit, mmr_select, pack_context
+from embedding_cache import EmbeddingCache
+from lexical_index import LexicalIndex
+from llm_resilience import get_endpoint
+from llm_scheduler import BACKGROUND, get_scheduler, llm_priority
+from llm_usage import llm_call_site, track_call
+from metadata_index import MetadataIndex
+from rag_store import EmbeddingStore, content_hash
+from single_flight import coalesce, request_key
+from vector_index import VectorIndex
+
+EMBED_MODEL = "text-embedding-3-small"
+# Optional reduced output size (text-embedding-3 supports e.g. 256/512/1024);
+# unset keeps the native 1536 dimensions.
+EMBED_DIMENSIONS = int(os.environ.get("RAG_EMBED_DIMENSIONS", "0")) or None
+# Cache/store key: vectors of different sizes must never be mixed
+EMBED_KEY = f"{EMBED_MODEL}:{EMBED_DIMENSIONS}" if EMBED_DIMENSIONS else EMBED_MODEL
+
+# Ingestion tuning: chunks per embeddings request, batches in flight at once,
+# and attempts per batch before its chunks are dropped.
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.environ.get("RAG_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_ATTEMPTS = 3
+# Question embeddings get their own resilience endpoint, so the p95 that
+# triggers their hedge reflects one-text requests, not ingestion batches
+EMBED_ENDPOINT = "openai.embeddings"
+QUERY_EMBED_ENDPOINT = "openai.embeddings.query"
+
+# Identifies the chunking scheme in persisted document keys; bump it whenever
+# chunk boundaries change so stale embeddings are not reused.
+CHUNKING = f"tokens-{CHUNK_TOKENS}-{CHUNK_OVERLAP}-v1"
+
+# Hybrid retrieval: how long a question embedding may take before falling back
+# to BM25 alone, how many candidates each ranker contributes, and the RRF constant.
+QUERY_EMBED_TIMEOUT = float(os.environ.get("RAG_QUERY_EMBED_TIMEOUT", "3"))
+FUSION_CANDIDATES = 20
+RRF_K = 60
+
+# RAM budget for all resident course collections. When exceeded, whole
+# collections are evicted least-recently-used first (never the active one);
+# their documents stay in the on-disk store and are mapped back on reuse.
+MEMORY_BUDGET_BYTES = int(float(os.environ.get("RAG_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+DEFAULT_COLLECTION = "default"
+DEFAULT_SOURCE = "document"
+
+
+class RagCollection:
+    """One course's chunks: vector, BM25 and metadata indexes with aligned row ids."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.vectors = VectorIndex()
+        self.lexical = LexicalIndex()
+        self.metadata = MetadataIndex()
+        # Content hashes of documents already indexed here, to skip re-adds
+        self.doc_hashes: set[str] = set()
+        # Partly embedded documents: content hash -> vectors of each batch already added
+        self.partial_docs: dict[str, dict[int, list]] = {}
+        # Documents still being embedded; their finished batches are already searchable
+        self.jobs: list[IngestJob] = []
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def add(self, vectors, payloads: list[dict]) -> None:
+        """Append chunks to every index together so row ids stay aligned."""
+        payloads = [dict(p, course=self.name) for p in payloads]
+        self.vectors.add(vectors, payloads)
+        self.lexical.add([p["text"] for p in payloads])
+        self.metadata.add(payloads)
+
+    def memory_bytes(self) -> int:
+        return self.vectors.memory_bytes() + self.lexical.memory_bytes() + self.metadata.memory_bytes()
+
+    def clear(self) -> None:
+        self.vectors.clear()
+        self.lexical.clear()
+        self.metadata.clear()
+        self.doc_hashes.clear()
+        self.partial_docs.clear()
+
+
+class IngestJob:
+    """Progress of one document's ingestion; `ready` is set once every batch has settled."""
+
+    def __init__(self, title: str, total: int):
+        self.title = title
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.ready = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.done - self.failed
+
+    def as_dict(self) -> dict:
+        return {"title": self.title, "total": self.total, "done": self.done, "failed": self.failed}
+
+
+# Resident collections in least- to most-recently-used order.
+_collections: "OrderedDict[str, RagCollection]" = OrderedDict()
+_active_name = DEFAULT_COLLECTION
+
+# Optional async callback receiving ingest_progress() snapshots (e.g. a websocket sender)
+_progress_listener = None
+# Strong references to fire-and-forget ingestion tasks so they are not garbage-collected
+_background_tasks: set[asyncio.Task] = set()
+
+# Shared by every ingestion path and by question embeddings
+embedding_cache = EmbeddingCache(max_entries=int(os.environ.get("RAG_EMBED_CACHE_SIZE", "5000")))
+
+# Study Q&A answers keyed by question embedding; see lookup_answer / remember_answer
+answer_cache = AnswerCache()
+
+_client: openai.AsyncOpenAI | None = None
+_store: EmbeddingStore | None = None
+
+
+def _get_store() -> EmbeddingStore:
+    """Lazily open the on-disk store shared by every session."""
+    global _store
+    if _store is None:
+        _store = EmbeddingStore()
+    return _store
+
+
+def _get_client() -> openai.AsyncOpenAI:
+    """Lazily create one AsyncOpenAI client and reuse its connection pool."""
+    global _client
+    if _client is None:
+        # Retries are handled by llm_resilience, not the SDK
+        _client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+
+async def _embed_batch(texts: list[str], hedge: bool = False, endpoint: str = EMBED_ENDPOINT) -> list:
+    """
+    Embed a list of texts, preserving input order. Cached texts are served
+    locally and only the misses go out, in a single request. Transient
+    failures are retried by the shared resilience layer; hedge=True also
+    races a duplicate request when the first is slower than usual, judged
+    by the latency of the named resilience endpoint.
+    """
+    vectors = [embedding_cache.get(EMBED_KEY, t) for t in texts]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if not missing:
+        embedding_cache.requests_saved += 1
+        return vectors
+    kwargs = {"dimensions": EMBED_DIMENSIONS} if EMBED_DIMENSIONS else {}
+    async def _attempt():
+        async with get_scheduler("openai").slot() as queued:
+            with track_call("openai", EMBED_MODEL, queued) as call:
+                response = await _get_client().embeddings.create(
+                    input=[texts[i] for i in missing], model=EMBED_MODEL, **kwargs
+                )
+                call.openai_usage(response)
+                return response
+
+    resilient = get_endpoint(endpoint, max_attempts=EMBED_MAX_ATTEMPTS)
+    # The same texts already being embedded (e.g. a repeated question) share that request
+    res = await coalesce(
+        "openai.embeddings", request_key(EMBED_KEY, [texts[i] for i in missing]),
+        lambda: resilient.call(_attempt, hedge=hedge),
+    )
+    for i, d in zip(missing, sorted(res.data, key=lambda d: d.index)):
+        vectors[i] = d.embedding
+        embedding_cache.put(EMBED_KEY, texts[i], d.embedding)
+    return vectors
+
+
+async def _embed_questions(questions: list[str]) -> list:
+    """Embed questions on the query endpoint, hedged and bounded by QUERY_EMBED_TIMEOUT."""
+    return await asyncio.wait_for(
+        _embed_batch(questions, hedge=True, endpoint=QUERY_EMBED_ENDPOINT), QUERY_EMBED_TIMEOUT
+    )
+
+
+def _restore_collection(collection: RagCollection) -> None:
+    """Map a collection's previously linked documents back in from the on-disk store."""
+    try:
+        store = _get_store()
+        for doc, title, source in store.collection_documents(collection.name):
+            if doc["content_hash"] in collection.doc_hashes or doc["model"] != EMBED_KEY:
+                continue
+            texts, vectors = store.load_document(doc)
+            collection.add(vectors, [{"text": t, "title": title, "source": source or DEFAULT_SOURCE} for t in texts])
+            collection.doc_hashes.add(doc["content_hash"])
+        if collection:
+            print(f"[RAG] Restored {len(collection)} chunks for collection '{collection.name}' from disk")
+    except Exception as e:
+        print(f"Error restoring RAG collection '{collection.name}': {e}")
+
+
+def get_collection(name: str | None = None) -> RagCollection:
+    """Return a resident collection (the active one by default), restoring it from disk if needed."""
+    name = name or _active_name
+    collection = _collections.get(name)
+    if collection is None:
+        collection = RagCollection(name)
+        _collections[name] = collection
+        _restore_collection(collection)
+        _enforce_memory_budget()
+    _collections.move_to_end(name)
+    return collection
+
+
+def set_active_collection(name: str) -> RagCollection:
+    """Make a course's collection the target for add_to_rag and query_rag."""
+    global _active_name
+    _active_name = (name or "").strip() or DEFAULT_COLLECTION
+    return get_collection(_active_name)
+
+
+def _enforce_memory_budget() -> None:
+    """
+    Evict least-recently-used collections until resident memory fits the budget.
+    The active collection and any still ingesting are kept: evicting a
+    collection mid-ingestion would strand the batches still landing in it.
+    """
+    total = sum(c.memory_bytes() for c in _collections.values())
+    for name in list(_collections):
+        if total <= MEMORY_BUDGET_BYTES:
+            break
+        if name == _active_name or _collections[name].jobs:
             continue
+        evicted = _collections.pop(name)
+        total -= evicted.memory_bytes()
+        print(f"[RAG] Evicted collection '{name}' ({len(evicted)} chunks) to stay under the memory budget")
+
+
+def set_progress_listener(listener) -> None:
+    """Register an async callable that receives ingestion progress snapshots."""
+    global _progress_listener
+    _progress_listener = listener
+
+
+def _progress_snapshot(target: RagCollection) -> dict:
+    return {
+        "collection": target.name,
+        "docs_pending": len(target.jobs),
+        "chunks_pending": sum(j.pending for j in target.jobs),
+        "chunks_indexed": len(target),
+        "documents": [j.as_dict() for j in target.jobs],
+    }
+
+
+def ingest_progress(collection: str | None = None) -> dict:
+    """Pending documents/chunks for a collection (the active one by default)."""
+    return _progress_snapshot(get_collection(collection))
+
+
+async def _publish_progress(collection: RagCollection) -> None:
+    if _progress_listener is None:
+        return
+    try:
+        # Built from the instance being filled: a name lookup could restore a fresh copy
+        await _progress_listener(_progress_snapshot(collection))
+    except Exception as e:
+        print(f"RAG progress listener error: {e}")
+
+
+async def wait_until_ready(title: str | None = None, collection: str | None = None,
+                           timeout: float = 5.0) -> bool:
+    """
+    Wait up to `timeout` seconds for pending ingestion in a collection to finish.
+    With a title, only that document is awaited. Returns True if nothing is left pending.
+    """
+    target = get_collection(collection)
+    jobs = [j for j in target.jobs if title is None or j.title == title]
+    if not jobs:
+        return True
+    try:
+        await asyncio.wait_for(asyncio.gather(*(j.ready.wait() for j in jobs)), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def ingest_in_background(text: str, title: str, collection: str | None = None,
+                         source: str = DEFAULT_SOURCE) -> asyncio.Task:
+    """
+    Start add_to_rag without awaiting it; chunks become searchable batch by
+    batch. Its embedding calls run at background LLM priority.
+    """
+    # Registered before the task runs, so a question asked right away waits for it
+    target = get_collection(collection)
+    job = IngestJob(title, 0)
+    target.jobs.append(job)
+    with llm_priority(BACKGROUND):
+        task = asyncio.create_task(add_to_rag(text, title, target.name, source, job=job))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def rag_chunk_count(collection: str | None = None) -> int:
+    """Number of chunks resident in a collection (the active one by default)."""
+    return len(get_collection(collection))
+
+
+async def add_to_rag(text: str, title: str, collection: str | None = None,
+                     source: str = DEFAULT_SOURCE, job: IngestJob | None = None) -> dict:
+    """
+    Chunk text, embed the chunks in concurrent batches, and store them in a
+    course collection (the active one unless named). `source` records the
+    kind of material (e.g. "canvas_file", "canvas_scrape") for filtering.
+
+    Each batch is searchable as soon as it lands, and progress is published
+    to the progress listener. Documents already embedded in a previous
+    session are mapped back from the on-disk store instead. Each batch is
+    retried on its own, so one failed request never re-embeds chunks that
+    already landed -- not even when the document is ingested again after a
+    failure. Returns ingestion stats (including chunks/sec).
+    `job` is the IngestJob already registered by ingest_in_background, if any.
+    """
+    # Resolve the target now so a course switch mid-ingestion cannot redirect chunks
+    target = get_collection(collection)
+    if job is None:
+        job = IngestJob(title, 0)
+        target.jobs.append(job)
+    try:
+        return await _ingest_document(target, job, text, title, source)
+    finally:
+        # Idempotent: _ingest_document normally settles the job before persisting
+        _settle_job(target, job)
+
+
+def _settle_job(target: RagCollection, job: IngestJob) -> None:
+    if job in target.jobs:
+        target.jobs.remove(job)
+    job.ready.set()
+
+
+async def _ingest_document(target: RagCollection, job: IngestJob, text: str, title: str, source: str) -> dict:
+    store = _get_store()
+    doc_hash = content_hash(text, CHUNKING)
+    if doc_hash in target.doc_hashes and doc_hash not in target.partial_docs:
+        return {"chunks": 0, "embedded": 0, "failed": 0, "from_store": 0, "duplicate": True}
+    target.doc_hashes.add(doc_hash)
+    # A retry of a partly embedded document only embeds the batches still missing
+    resumed = target.partial_docs.pop(doc_hash, None)
+    if resumed is None:
         try:
-            res = await client.embeddings.create(input=chunk, model="text-embedding-3-small")
-            storage.append({
-                "text": chunk, 
-                "title": title, 
-                "embedding": res.data[0].embedding
-            })
+            doc = store.find_document(doc_hash, EMBED_KEY)
+            if doc:
+                texts, vectors = store.load_document(doc)
+                target.add(vectors, [{"text": t, "title": title, "source": source} for t in texts])
+                store.link_document(target.name, doc["id"], title, source)
+                _enforce_memory_budget()
+                print(f"[RAG] Loaded {len(texts)} stored chunks for '{title}' from disk")
+                return {"chunks": len(texts), "embedded": 0, "failed": 0, "from_store": len(texts)}
         except Exception as e:
-            print(f"Error embedding chunk: {e}")
-
-def cosine_similarity(v1, v2):
-    dot = sum(a*b for a, b in zip(v1, v2))
-    mag1 = math.sqrt(sum(a*a for a in v1))
-    mag2 = math.sqrt(sum(b*b for b in v2))
-    if mag1 == 0 or mag2 == 0: 
-        return 0
-    return dot / (mag1 * mag2)
-
-async def query_rag(question: str, top_k: int = 5) -> str:
-    """Embed the question and find top_k most similar chunks."""
-    global storage
-    if not storage:
-        return ""
-    
-    try:
-        client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        res = await client.embeddings.create(input=question, model="text-embedding-3-small")
-        q_emb = res.data[0].embedding
-        
-        scored = []
-        for item in storage:
-            sim = cosine_similarity(q_emb, item["embedding"])
-            scored.append((sim, item))
-        
-        scored.sort(key=lambda x: x[0], reverse=True)
-        top = scored[:top_k]
-        
-        return "\n\n---\n\n".join([f"Source: {item[1]['title']}\n{item[1]['text']}" for item in top])
+            print(f"Error reading RAG store: {e}")
+
+    chunks = chunk_text(text)
+    batches = [chunks[i:i + EMBED_BATCH_SIZE] for i in range(0, len(chunks), EMBED_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    landed: dict[int, list[list[float]]] = resumed or {}
+    job.total = len(chunks)
+    job.done = sum(len(batches[n]) for n in landed)
+    await _publish_progress(target)
+
+    async def _ingest(batch_no: int, batch: list[str]) -> int:
+        async with semaphore:
+            try:
+                # Retried per batch inside _embed_batch
+                with llm_call_site("rag_ingest"):
+                    vectors = await _embed_batch(batch)
+            except Exception as e:
+                print(f"Error embedding batch of {len(batch)} chunks: {e}")
+                job.failed += len(batch)
+                await _publish_progress(target)
+                return 0
+            target.add(vectors, [{"text": c, "title": title, "source": source} for c in batch])
+            landed[batch_no] = vectors
+            job.done += len(batch)
+            await _publish_progress(target)
+            return len(batch)
+
+    started = time.perf_counter()
+    try:
+        embedded = sum(await asyncio.gather(
+            *(_ingest(n, b) for n, b in enumerate(batches) if n not in landed)
+        ))
+    finally:
+        _settle_job(target, job)
+    elapsed = time.perf_counter() - started
+    await _publish_progress(target)
+    # Only complete documents are persisted, so a later hit never serves a partial doc
+    if chunks and len(landed) == len(batches):
+        try:
+            doc_id = store.save_document(
+                title, doc_hash, EMBED_KEY, chunks,
+                [v for n in range(len(batches)) for v in landed[n]],
+            )
+            store.link_document(target.name, doc_id, title, source)
+        except Exception as e:
+            print(f"Error writing RAG store: {e}")
+    elif landed:
+        # Keep the landed batches indexed; a retry embeds only the rest
+        target.partial_docs[doc_hash] = landed
+    else:
+        # Nothing landed: allow a retry to embed the document again
+        target.doc_hashes.discard(doc_hash)
+    _enforce_memory_budget()
+    rate = embedded / elapsed if elapsed > 0 else 0.0
+    print(f"[RAG] Embedded {embedded}/{len(chunks)} chunks from '{title}' "
+          f"in {elapsed:.2f}s ({rate:.1f} chunks/sec, {len(batches)} batches)")
+    return {
+        "chunks": len(chunks),
+        "embedded": embedded,
+        "failed": job.failed,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(rate, 1),
+        "from_store": 0,
+    }
+
+def _fuse(rankings: list[list[tuple[int, float]]], top_k: int) -> list[tuple[int, float]]:
+    """Reciprocal-rank fusion: each ranking adds 1 / (RRF_K + rank) per row."""
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+
+
+async def embed_question(question: str) -> list[float] | None:
+    """
+    Embed a question under QUERY_EMBED_TIMEOUT, or None if that fails. Lets a
+    caller embed once and hand the vector to lookup_answer, search_rag and
+    remember_answer instead of waiting on the embedding API for each.
+    """
+    try:
+        with llm_call_site("rag_query"):
+            return (await _embed_questions([question]))[0]
+    except Exception as e:
+        print(f"Error embedding RAG query ({type(e).__name__}: {e})")
+        return None
+
+
+async def search_rag(question: str, top_k: int = 5, mode: str = "hybrid",
+                     collection: str | None = None, diversify: bool = True,
+                     include: dict | None = None, exclude: dict | None = None,
+                     embedding: list[float] | None = None) -> list[dict]:
+    """
+    Rank chunks in one collection (the active course by default) for a
+    question. Returns payload dicts with "id" and "score".
+
+    mode:
+      "vector"  -- embedding cosine similarity only (needs the embedding API)
+      "lexical" -- BM25 only, no network call
+      "hybrid"  -- RRF of both; degrades to BM25 if the question embedding
+                   fails or exceeds QUERY_EMBED_TIMEOUT
+
+    With diversify, a deeper candidate pool is re-ranked by maximal marginal
+    relevance and near-duplicate chunks are dropped.
+
+    include / exclude map a metadata field ("title", "course", "source") to
+    one or more case-insensitive substrings, e.g. include={"title": ["L5", "L6"]}.
+    Filters are applied before scoring.
+
+    Pass `embedding` (from embed_question) to skip embedding the question again.
+    """
+    results = await search_rag_many([question], top_k, mode, collection, diversify, include, exclude,
+                                    embeddings=[embedding] if embedding is not None else None)
+    return results[0] if results else []
+
+
+async def search_rag_many(questions: list[str], top_k: int = 5, mode: str = "hybrid",
+                          collection: str | None = None, diversify: bool = True,
+                          include: dict | None = None, exclude: dict | None = None,
+                          embeddings: list | None = None) -> list[list[dict]]:
+    """
+    search_rag for several questions against the same collection and filters.
+
+    All questions are embedded in one request (unless `embeddings` are
+    given) and scored with one matrix-matrix product; returns one hit list
+    per question, in order.
+    """
+    target = get_collection(collection)
+    if not questions or not target or mode not in ("vector", "lexical", "hybrid"):
+        return [[] for _ in questions]
+    vectors, lexical = target.vectors, target.lexical
+    rows = target.metadata.resolve(include, exclude)
+    if rows is not None and len(rows) == 0:
+        return [[] for _ in questions]
+    final_k = top_k
+    if diversify:
+        top_k = max(FUSION_CANDIDATES, 3 * top_k)
+    depth = top_k if mode == "vector" else max(FUSION_CANDIDATES, top_k)
+
+    vector_rankings = None
+    if mode != "lexical":
+        try:
+            q_embs = embeddings
+            if q_embs is None:
+                with llm_call_site("rag_query"):
+                    q_embs = await _embed_questions(questions)
+            vector_rankings = vectors.search_many(q_embs, depth, rows=rows)
+        except Exception as e:
+            print(f"Error embedding RAG query ({type(e).__name__}: {e}) -- using BM25 only")
+
+    results: list[list[dict]] = []
+    for i, question in enumerate(questions):
+        if vector_rankings is None:
+            ranked = lexical.search(question, top_k, rows)
+        elif mode == "vector":
+            ranked = vector_rankings[i]
+        else:
+            ranked = _fuse([vector_rankings[i], lexical.search(question, depth, rows)], top_k)
+
+        if diversify and ranked:
+            picked_rows = np.array([r for r, _ in ranked])
+            picks = mmr_select([score for _, score in ranked], vectors.dense(picked_rows), final_k)
+            ranked = [ranked[p] for p in picks]
+        results.append([dict(vectors.payloads[r], id=r, score=score) for r, score in ranked[:final_k]])
+    return results
+
+
+def format_context(hits: list[dict], token_budget: int | None = None) -> str:
+    """Render search hits as prompt context, packed to token_budget if given."""
+    if token_budget:
+        return pack_context(hits, token_budget)
+    return SEPARATOR.join(format_hit(h) for h in hits)
+
+
+async def query_rag(question: str, top_k: int = 5, mode: str = "hybrid",
+                    collection: str | None = None, wait_for: str | None = None,
+                    wait_timeout: float = 5.0, token_budget: int | None = None,
+                    include: dict | None = None, exclude: dict | None = None) -> str:
+    """
+    Find the top_k chunks for a question and format them as prompt context.
+
+    wait_for names a document still being ingested ("*" for all pending
+    documents); the query waits up to wait_timeout seconds for it before
+    searching whatever has landed so far. With token_budget, the most
+    relevant distinct chunks (up to top_k) are packed until the budget is full.
+    include / exclude are metadata filters (see search_rag).
+    """
+    try:
+        if wait_for:
+            await wait_until_ready(None if wait_for == "*" else wait_for, collection, wait_timeout)
+        hits = await search_rag(question, top_k, mode, collection, include=include, exclude=exclude)
+        return format_context(hits, token_budget)
     except Exception as e:
         print(f"Error querying RAG: {e}")
         return ""
 
-def clear_rag():
-    """Clear memory."""
-    global storage
-    storage = []
+
+async def query_rag_many(questions: list[str], top_k: int = 5, mode: str = "hybrid",
+                         collection: str | None = None, wait_for: str | None = None,
+                         wait_timeout: float = 5.0, token_budget: int | None = None,
+                         include: dict | None = None, exclude: dict | None = None) -> list[str]:
+    """
+    query_rag for several questions with one embedding request and one
+    scoring pass. Returns one context string per question, in order
+    ("" for a question with no hits or if retrieval fails).
+    """
+    try:
+        if wait_for:
+            await wait_until_ready(None if wait_for == "*" else wait_for, collection, wait_timeout)
+        results = await search_rag_many(questions, top_k, mode, collection, include=include, exclude=exclude)
+        return [format_context(hits, token_budget) for hits in results]
+    except Exception as e:
+        print(f"Error querying RAG: {e}")
+        return ["" for _ in questions]
+
+def _answer_scope(collection: str, include: dict | None, exclude: dict | None) -> str:
+    """Cached answers only apply to the same collection and retrieval filters."""
+    return repr((collection, include or {}, exclude or {}))
+
+
+def _sources_unchanged(collection: str, sources: list[tuple[int, int]]) -> bool:
+    """True while every (row id, text hash) a cached answer used is still in the index."""
+    payloads = get_collection(collection).vectors.payloads
+    return all(row < len(payloads) and hash(payloads[row]["text"]) == fingerprint
+               for row, fingerprint in sources)
+
+
+async def lookup_answer(question: str, collection: str | None = None,
+                        include: dict | None = None, exclude: dict | None = None,
+                        embedding: list[float] | None = None) -> str | None:
+    """
+    A previously generated answer to a semantically equivalent question,
+    or None. Valid only while the chunks it was grounded on are unchanged.
+    `embedding` skips embedding the question here.
+    """
+    name = collection or _active_name
+    q_emb = embedding
+    if q_emb is None:
+        try:
+            with llm_call_site("rag_answer_cache"):
+                q_emb = (await _embed_questions([question]))[0]
+        except Exception as e:
+            print(f"Error embedding question for answer cache ({type(e).__name__}: {e})")
+            return None
+    entry = answer_cache.get(_answer_scope(name, include, exclude), q_emb,
+                             lambda sources: _sources_unchanged(name, sources))
+    if entry is None:
+        return None
+    print(f"[RAG] Answer cache hit (similarity {entry['similarity']:.3f})")
+    return entry["answer"]
+
+
+async def remember_answer(question: str, answer: str, hits: list[dict], collection: str | None = None,
+                          include: dict | None = None, exclude: dict | None = None,
+                          embedding: list[float] | None = None) -> None:
+    """Cache an answer with the search hits it was generated from. Answers without sources are not cached."""
+    if not hits or not answer:
+        return
+    q_emb = embedding
+    if q_emb is None:
+        try:
+            # Normally an embedding-cache hit: lookup_answer/search_rag already embedded it
+            with llm_call_site("rag_answer_cache"):
+                q_emb = (await _embed_batch([question], endpoint=QUERY_EMBED_ENDPOINT))[0]
+        except Exception as e:
+            print(f"Error caching answer: {e}")
+            return
+    name = collection or _active_name
+    answer_cache.put(_answer_scope(name, include, exclude), q_emb, answer,
+                     [(h["id"], hash(h["text"])) for h in hits])
+
+
+def clear_rag(collection: str | None = None):
+    """Clear a collection's in-memory indexes. Persisted embeddings stay on disk for reuse."""
+    get_collection(collection).clear()
+
+
+def get_rag_stats() -> dict:
+    """Resident collections plus embedding-cache and on-disk store counters."""
+    stats = {
+        "active_collection": _active_name,
+        "memory_budget_bytes": MEMORY_BUDGET_BYTES,
+        "collections": {
+            name: {"chunks": len(c), "memory_bytes": c.memory_bytes(), "titles": c.metadata.values("title")}
+            for name, c in _collections.items()
+        },
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+    try:
+        stats["store"] = _get_store().stats()
+    except Exception as e:
+        stats["store"] = {"error": str(e)}
+    return stats
@@ -0,0 +1,187 @@
+"""
+rag_bench.py -- Offline retrieval benchmark suite for the RAG indexes.
+
+Builds synthetic corpora with deterministic fake embeddings (topic-clustered
+Gaussian vectors) and matching fake chunk text, so it needs no network
+access or API keys. For each corpus size it measures:
+
+  - ingest throughput (chunks/sec into a RagCollection: vectors + BM25)
+  - p50/p99 query latency for exact, IVF, float16, int8 and BM25 search
+  - resident memory per chunk (tracemalloc) for each storage dtype
+  - recall@k of the IVF and compressed modes against exact float32 search
+
+Results are written as JSON so runs can be diffed between releases.
+
+Usage (from backend/):
+  python rag_bench.py --sizes 1000,10000,100000 --out rag_bench_results.json
+"""
+import argparse
+import functools
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from rag import EMBED_BATCH_SIZE, RagCollection
+from vector_index import IVF_NPROBE, VectorIndex
+
+_VOCAB_PER_TOPIC = 40
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int = 64, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Topic-clustered vectors, roughly like embeddings of chunks from a handful of lectures.
+    Returns (vectors, topic label per row)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels]
+    vectors += 0.6 * rng.standard_normal(size=(n, dim), dtype=np.float32)
+    return vectors, labels
+
+
+def synthetic_texts(labels: np.ndarray, words: int = 60, seed: int = 0) -> list[str]:
+    """Fake chunk text drawn from a per-topic vocabulary, so BM25 has realistic postings."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, _VOCAB_PER_TOPIC, size=(len(labels), words))
+    return [" ".join(f"t{label}w{w}" for w in row) for label, row in zip(labels, picks)]
+
+
+def synthetic_queries(corpus: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Noisy copies of random corpus rows, so every query has close neighbours."""
+    rng = np.random.default_rng(seed)
+    picks = corpus[rng.integers(0, len(corpus), size=count)]
+    return picks + 0.4 * rng.standard_normal(size=picks.shape, dtype=np.float32)
+
+
+def recall_at_k(truth: list[list[int]], approx: list[list[int]]) -> float:
+    """Mean fraction of the exact top-k ids that the approximate search also returned."""
+    hits = [len(set(t) & set(a)) / len(t) for t, a in zip(truth, approx) if t]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def _latency(fn, queries) -> tuple[dict, list]:
+    """Run fn over every query; return p50/p99 in ms plus the results."""
+    timings, results = [], []
+    for q in queries:
+        started = time.perf_counter()
+        results.append(fn(q))
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p99_ms": round(float(np.percentile(timings, 99)), 3),
+    }, results
+
+
+def _build_index(vectors: np.ndarray, dtype: str) -> tuple[VectorIndex, int]:
+    """Fill a VectorIndex (IVF auto-build disabled) and return it with its traced size in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = VectorIndex(dtype=dtype, ivf_min_rows=len(vectors) + 1)
+    for start in range(0, len(vectors), EMBED_BATCH_SIZE):
+        stop = start + EMBED_BATCH_SIZE
+        index.add(vectors[start:stop], [{} for _ in range(len(vectors[start:stop]))])
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return index, used
+
+
+def _search_ids(index: VectorIndex, k: int, q: np.ndarray, **kwargs) -> list[int]:
+    return [i for i, _ in index.search(q, k, **kwargs)]
+
+
+def _bench_ingest(vectors: np.ndarray, texts: list[str], queries, query_texts, k: int) -> tuple[dict, dict, list, dict]:
+    """Ingest through RagCollection; return ingest stats, exact latency, ground-truth ids and BM25 latency."""
+    n = len(vectors)
+    # The same path add_to_rag uses once embeddings land
+    collection = RagCollection("bench")
+    started = time.perf_counter()
+    for start in range(0, n, EMBED_BATCH_SIZE):
+        stop = start + EMBED_BATCH_SIZE
+        collection.add(vectors[start:stop], [{"text": t, "title": "bench"} for t in texts[start:stop]])
+    elapsed = time.perf_counter() - started
+    ingest = {
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(n / elapsed, 1) if elapsed > 0 else None,
+        "collection_bytes_per_chunk": round(collection.memory_bytes() / n, 1),
+    }
+    exact_latency, truth = _latency(functools.partial(_search_ids, collection.vectors, k, exact=True), queries)
+    lexical_latency, _ = _latency(functools.partial(collection.lexical.search, top_k=k), query_texts)
+    return ingest, exact_latency, truth, lexical_latency
+
+
+def _bench_ivf(vectors: np.ndarray, queries, truth: list, k: int, nprobe: int) -> tuple[dict, int]:
+    """IVF float32 search stats, plus the traced size of the flat float32 index."""
+    index, traced = _build_index(vectors, "float32")
+    started = time.perf_counter()
+    index.ivf_min_rows = 0
+    index.build_ivf()
+    build_seconds = time.perf_counter() - started
+    latency, ids = _latency(functools.partial(_search_ids, index, k, nprobe=nprobe), queries)
+    return dict(
+        latency,
+        recall_at_k=round(recall_at_k(truth, ids), 4),
+        nprobe=nprobe,
+        nlist=index._ivf.nlist,
+        build_seconds=round(build_seconds, 3),
+    ), traced
+
+
+def _bench_exact(vectors: np.ndarray, dtype: str, queries, truth: list, k: int) -> dict:
+    """Exact-search stats for a quantized index."""
+    index, traced = _build_index(vectors, dtype)
+    latency, ids = _latency(functools.partial(_search_ids, index, k, exact=True), queries)
+    return dict(latency, recall_at_k=round(recall_at_k(truth, ids), 4), bytes_per_chunk=round(traced / len(vectors), 1))
+
+
+def bench_corpus(n: int, dim: int, num_queries: int, k: int, nprobe: int) -> dict:
+    vectors, labels = synthetic_embeddings(n, dim)
+    texts = synthetic_texts(labels)
+    queries = synthetic_queries(vectors, num_queries)
+    query_texts = [" ".join(t.split()[:8]) for t in synthetic_texts(labels[:num_queries], seed=2)]
+    result: dict = {"chunks": n, "dim": dim, "queries": num_queries, "k": k}
+
+    # Each stage builds its index in a helper so it is freed before the next one is built
+    result["ingest"], exact_latency, truth, lexical_latency = _bench_ingest(vectors, texts, queries, query_texts, k)
+    modes: dict = {"exact_float32": dict(exact_latency, recall_at_k=1.0), "bm25": lexical_latency}
+    modes["ivf_float32"], traced = _bench_ivf(vectors, queries, truth, k, nprobe)
+    modes["exact_float32"]["bytes_per_chunk"] = round(traced / n, 1)
+    for dtype in ("float16", "int8"):
+        modes[f"exact_{dtype}"] = _bench_exact(vectors, dtype, queries, truth, k)
+
+    result["modes"] = modes
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG retrieval benchmark suite")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    parser.add_argument("--out", default="rag_bench_results.json")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "corpora": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"[bench] {size} chunks x {args.dim} dims ...")
+        corpus = bench_corpus(size, args.dim, args.queries, args.k, args.nprobe)
+        report["corpora"].append(corpus)
+        for mode, stats in corpus["modes"].items():
+            print(f"  {mode:<14} p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms"
+                  + (f" recall@{args.k}={stats['recall_at_k']}" if "recall_at_k" in stats else ""))
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[bench] wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
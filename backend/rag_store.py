@@ -0,0 +1,184 @@
+"""
+rag_store.py -- Persistent embedding store shared across study sessions.
+
+Vectors are appended to a raw float32 file that is memory-mapped on read;
+chunk text and document metadata live in a SQLite file next to sayam.db.
+A document is keyed by (content hash, embedding model), so re-opening the
+same Canvas PDF in a later session or after a restart maps its rows back
+in instead of paying for a full re-embedding.
+"""
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+from database import DB_FILENAME
+
+STORE_DIR = os.path.dirname(os.path.abspath(DB_FILENAME))
+STORE_DB = os.path.join(STORE_DIR, "rag_store.db")
+
+
+def content_hash(text: str, chunking: str = "") -> str:
+    """Stable document key. `chunking` describes the chunker so a change re-embeds."""
+    h = hashlib.sha256()
+    h.update(chunking.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk store. Each document owns a contiguous row range in
+    the vectors file for its embedding dimension; the file is only mapped
+    when a document is first loaded.
+    """
+
+    def __init__(self, db_path: str = STORE_DB, vectors_dir: str = STORE_DIR):
+        self.db_path = db_path
+        self.vectors_dir = vectors_dir
+        self._maps: dict[int, np.memmap] = {}
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rag_documents (
+                id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                title        TEXT,
+                content_hash TEXT NOT NULL,
+                model        TEXT NOT NULL,
+                dim          INTEGER NOT NULL,
+                row_start    INTEGER NOT NULL,
+                row_count    INTEGER NOT NULL,
+                created_at   TEXT DEFAULT (datetime('now')),
+                last_used_at TEXT DEFAULT (datetime('now'))
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rag_chunks (
+                doc_id INTEGER NOT NULL,
+                row    INTEGER NOT NULL,
+                text   TEXT NOT NULL,
+                PRIMARY KEY (doc_id, row)
+            )
+            ''')
+            # Which documents belong to which course collection (a PDF can be in several)
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rag_collection_documents (
+                collection TEXT NOT NULL,
+                doc_id     INTEGER NOT NULL,
+                title      TEXT,
+                source     TEXT,
+                PRIMARY KEY (collection, doc_id)
+            )
+            ''')
+            # Migrate: add source type if missing (stores created before metadata filters)
+            cols = {row[1] for row in conn.execute("PRAGMA table_info(rag_collection_documents)").fetchall()}
+            if "source" not in cols:
+                conn.execute("ALTER TABLE rag_collection_documents ADD COLUMN source TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_rag_documents_hash ON rag_documents (content_hash, model)"
+            )
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _vectors_path(self, dim: int) -> str:
+        return os.path.join(self.vectors_dir, f"rag_vectors_{dim}.f32")
+
+    def _rows_on_disk(self, dim: int) -> int:
+        path = self._vectors_path(dim)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (4 * dim)
+
+    def _map(self, dim: int, rows_needed: int) -> np.memmap:
+        """Return a read-only map covering at least rows_needed rows, remapping if the file grew."""
+        mm = self._maps.get(dim)
+        if mm is None or mm.shape[0] < rows_needed:
+            rows = self._rows_on_disk(dim)
+            mm = np.memmap(self._vectors_path(dim), dtype=np.float32, mode="r", shape=(rows, dim))
+            self._maps[dim] = mm
+        return mm
+
+    def find_document(self, doc_hash: str, model: str) -> dict | None:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT * FROM rag_documents WHERE content_hash = ? AND model = ? ORDER BY id DESC LIMIT 1",
+            (doc_hash, model),
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE rag_documents SET last_used_at = datetime('now') WHERE id = ?", (row["id"],))
+            conn.commit()
+        conn.close()
+        return dict(row) if row else None
+
+    def load_document(self, doc: dict) -> tuple[list[str], np.ndarray]:
+        """Return (chunk texts, vectors) for a stored document. Vectors are a view into the map."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT text FROM rag_chunks WHERE doc_id = ? ORDER BY row", (doc["id"],)
+        ).fetchall()
+        conn.close()
+        start, count = doc["row_start"], doc["row_count"]
+        mm = self._map(doc["dim"], start + count)
+        return [r["text"] for r in rows], mm[start : start + count]
+
+    def save_document(self, title: str, doc_hash: str, model: str,
+                      texts: list[str], vectors) -> int:
+        """Append a fully embedded document. Vectors are written before the metadata commit."""
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(texts) or len(texts) == 0:
+            raise ValueError("save_document needs one vector per chunk text")
+        dim = matrix.shape[1]
+        row_start = self._rows_on_disk(dim)
+        with open(self._vectors_path(dim), "ab") as f:
+            f.write(matrix.tobytes())
+
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO rag_documents (title, content_hash, model, dim, row_start, row_count) VALUES (?, ?, ?, ?, ?, ?)",
+            (title, doc_hash, model, dim, row_start, len(texts)),
+        )
+        doc_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO rag_chunks (doc_id, row, text) VALUES (?, ?, ?)",
+            [(doc_id, i, t) for i, t in enumerate(texts)],
+        )
+        conn.commit()
+        conn.close()
+        return doc_id
+
+    def link_document(self, collection: str, doc_id: int, title: str, source: str | None = None) -> None:
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO rag_collection_documents (collection, doc_id, title, source) VALUES (?, ?, ?, ?)",
+            (collection, doc_id, title, source),
+        )
+        conn.commit()
+        conn.close()
+
+    def collection_documents(self, collection: str) -> list[tuple[dict, str, str | None]]:
+        """Return (document row, title, source type) triples previously linked to a collection."""
+        conn = self._connect()
+        rows = conn.execute(
+            """SELECT d.*, c.title AS linked_title, c.source AS linked_source FROM rag_collection_documents c
+               JOIN rag_documents d ON d.id = c.doc_id
+               WHERE c.collection = ? ORDER BY d.id""",
+            (collection,),
+        ).fetchall()
+        conn.close()
+        return [(dict(r), r["linked_title"], r["linked_source"]) for r in rows]
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT COUNT(*) AS documents, COALESCE(SUM(row_count), 0) AS chunks FROM rag_documents"
+        ).fetchone()
+        conn.close()
+        return {"documents": row["documents"], "chunks": row["chunks"]}
@@ -0,0 +1,140 @@
+"""
+response_cache.py -- Persistent cache of watsonx generations.
+
+Opt-in per call: wx_json / wx_chat only consult it when the call site
+passes a cache_ttl, and only store output that passes the call site's
+validate check (so a malformed reply is never replayed). Entries are
+keyed by (model, prompt hash, decoding params), expire after their TTL,
+and are evicted least-recently-used once the table holds more than
+LLM_CACHE_MAX_ENTRIES rows. The table lives in llm_cache.db next to
+sayam.db, so repeat generations survive restarts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from database import DB_FILENAME
+
+CACHE_DB = os.path.join(os.path.dirname(os.path.abspath(DB_FILENAME)), "llm_cache.db")
+CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000"))
+
+# Call-site TTLs in seconds
+TTL_HOUR = 60 * 60
+TTL_DAY = 24 * TTL_HOUR
+TTL_WEEK = 7 * TTL_DAY
+
+
+def cache_key(model: str, prompt: str, params: dict) -> str:
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """SQLite table of key -> generated text with expiry and last-use times."""
+
+    def __init__(self, db_path: str = CACHE_DB, max_entries: int = CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        if not self._initialized:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key          TEXT PRIMARY KEY,
+                model        TEXT NOT NULL,
+                response     TEXT NOT NULL,
+                created_at   REAL NOT NULL,
+                expires_at   REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            ''')
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_responses_used ON llm_responses (last_used_at)"
+            )
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT response, expires_at FROM llm_responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row and row[1] > now:
+            conn.execute("UPDATE llm_responses SET last_used_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            conn.close()
+            self.hits += 1
+            return row[0]
+        if row:
+            conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+            conn.commit()
+        conn.close()
+        self.misses += 1
+        return None
+
+    def put(self, key: str, model: str, response: str, ttl: float) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_responses (key, model, response, created_at, expires_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, response, now, now + ttl, now),
+        )
+        # Drop expired rows, then the least recently used beyond the cap
+        conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+        count = conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM llm_responses WHERE key IN "
+                "(SELECT key FROM llm_responses ORDER BY last_used_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.evictions += count - self.max_entries
+        conn.commit()
+        conn.close()
+
+    def invalidate(self, key: str) -> None:
+        """Drop an entry that get() returned but the caller could not use (counted as a miss)."""
+        conn = self._connect()
+        conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+        conn.commit()
+        conn.close()
+        self.hits -= 1
+        self.misses += 1
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM llm_responses")
+        conn.commit()
+        conn.close()
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
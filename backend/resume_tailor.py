@@ -18,6 +18,11 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
 
+from llm_resilience import get_endpoint
+from llm_scheduler import get_scheduler
+from llm_usage import track_call
+from single_flight import coalesce, request_key
+
 
 # ── Job Description Fetcher ───────────────────────────────────────────────────
 
@@ -48,7 +53,7 @@ async def generate_tailored_content(
     Ask GPT-4o to produce a tailored resume JSON.
     Only experience/project bullets are rephrased — everything else is verbatim.
     """
-    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 
     job_context = (
         f"Job Description (scraped from posting):\n{job_description[:4000]}"
@@ -127,11 +132,20 @@ Return ONLY a valid JSON object with this exact structure (no markdown, no expla
 
 Only include sections that exist in the original resume. Return only valid JSON."""
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
-        response_format={"type": "json_object"},
+    async def _attempt():
+        async with get_scheduler("openai").slot() as queued:
+            with track_call("openai", "gpt-4o", queued, site="resume_tailor") as call:
+                response = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.3,
+                    response_format={"type": "json_object"},
+                )
+                call.openai_usage(response)
+                return response
+
+    response = await coalesce(
+        "openai.chat", request_key("gpt-4o", prompt), lambda: get_endpoint("openai.chat").call(_attempt)
     )
     raw = response.choices[0].message.content.strip()
     return json.loads(raw)
@@ -0,0 +1,75 @@
+"""
+single_flight.py -- In-flight coalescing of identical LLM / embedding requests.
+
+A double-clicked "Cards from page", a websocket reconnect replaying a
+message, or the SMS flow racing the desktop one can send byte-identical
+prompts while the first call is still running. coalesce() runs one
+upstream call per key and fans its result (or exception) out to every
+concurrent caller; once it settles, the key is free again. Counters per
+group show how many upstream calls were saved.
+"""
+import asyncio
+import hashlib
+import json
+import weakref
+
+
+def request_key(*parts) -> str:
+    """Stable hash of JSON-serializable request parts (model, prompt, params, ...)."""
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class _Group:
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        self.waiters: dict[str, int] = {}
+
+
+_groups: dict[str, _Group] = {}
+# In-flight tasks are bound to their event loop, so keys are tracked per loop
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+
+async def coalesce(group: str, key: str, factory):
+    """
+    Await factory() unless an identical call (same group and key) is already
+    running, in which case await that call's result instead.
+    """
+    stats = _groups.setdefault(group, _Group())
+    stats.calls += 1
+    loop = asyncio.get_running_loop()
+    inflight = _inflight.setdefault(loop, {})
+    task = inflight.get((group, key))
+    if task is None:
+        task = loop.create_task(factory())
+        inflight[(group, key)] = task
+        stats.waiters[key] = 1
+
+        def _settled(_task, k=(group, key)):
+            if inflight.get(k) is _task:
+                del inflight[k]
+            stats.waiters.pop(k[1], None)
+
+        task.add_done_callback(_settled)
+    else:
+        stats.coalesced += 1
+        stats.waiters[key] = stats.waiters.get(key, 1) + 1
+        stats.max_waiters = max(stats.max_waiters, stats.waiters[key])
+    # Shielded: one caller giving up must not cancel the call others are awaiting
+    return await asyncio.shield(task)
+
+
+def coalescing_stats() -> dict:
+    return {
+        name: {
+            "calls": g.calls,
+            "upstream_calls": g.calls - g.coalesced,
+            "calls_saved": g.coalesced,
+            "in_flight": len(g.waiters),
+            "max_waiters": g.max_waiters,
+        }
+        for name, g in _groups.items()
+    }
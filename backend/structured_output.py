@@ -0,0 +1,327 @@
+"""
+structured_output.py -- Schema-checked JSON from Granite, repaired locally first.
+
+Granite's JSON is usually almost right: wrapped in ```json fences, with a
+trailing comma, cut off mid-array at max_new_tokens, or nested under a
+wrapper key like {"cards": [...]}. Rather than dropping the whole
+response, wx_structured():
+
+  1. repairs the text locally (fences, surrounding prose, trailing commas,
+     truncation -- closing the JSON after the last complete element)
+  2. checks it against a per-artifact Schema, keeping the valid items of a
+     partially valid list instead of rejecting it
+  3. only if that still fails, re-prompts once with the bad output
+
+Outcomes are counted per call site (clean / repaired / salvaged /
+reprompted / failed) so the repair rate can be watched over time.
+"""
+import json
+import re
+from dataclasses import dataclass, field
+
+from llm_usage import llm_call_site
+from watsonx_client import wx_json
+
+_FENCE = re.compile(r"```(?:json|JSON)?")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_TRUNCATION_CANDIDATES = 50
+
+
+class StructuredOutputError(ValueError):
+    """The model output could not be repaired into the expected structure."""
+    raw: str = ""
+
+
+@dataclass(frozen=True)
+class ItemSpec:
+    """A JSON object with required typed fields and an optional extra check."""
+    required: dict
+    check: object = None
+
+    def valid(self, item) -> bool:
+        if not isinstance(item, dict):
+            return False
+        for key, kind in self.required.items():
+            value = item.get(key)
+            if not isinstance(value, kind) or isinstance(value, bool) and kind is not bool:
+                return False
+        return self.check is None or bool(self.check(item))
+
+
+@dataclass(frozen=True)
+class Schema:
+    """
+    Expected shape of one artifact. `item` makes it a list of ItemSpec
+    objects; otherwise it is an object whose `lists` fields (field -> ItemSpec
+    or a plain type such as str) are salvaged item by item. `keys`, if
+    set, drops any other top-level keys the model invents.
+    """
+    name: str
+    item: ItemSpec | None = None
+    lists: dict = field(default_factory=dict)
+    wrapper_keys: tuple = ()
+    min_items: int = 1
+    max_items: int | None = None
+    keys: tuple = ()
+
+
+# ── Per-artifact schemas ─────────────────────────────────────────────────────
+
+FLASHCARDS = Schema(
+    "flashcards",
+    item=ItemSpec({"front": str, "back": str}),
+    wrapper_keys=("cards", "flashcards", "items", "data"),
+    max_items=8,
+)
+STUDY_MATERIAL = Schema(
+    "study_material",
+    lists={
+        "concepts": ItemSpec({"title": str}),
+        "questions": ItemSpec(
+            {"text": str, "options": list, "correct_index": int},
+            check=lambda q: 0 <= q["correct_index"] < len(q["options"]),
+        ),
+    },
+)
+STUDY_STEPS = Schema(
+    "study_steps",
+    item=ItemSpec({"text": str}),
+    wrapper_keys=("steps", "plan", "study_plan"),
+    max_items=5,
+)
+QUIZ_FEEDBACK = Schema("quiz_feedback", lists={"study_plan": str}, min_items=0)
+RESUME_PROFILE = Schema(
+    "resume_profile",
+    lists={"skills": str, "target_roles": str},
+    min_items=0,
+    keys=("name", "email", "phone", "gpa", "location", "university", "graduation_year", "skills", "target_roles"),
+)
+
+
+# ── Local repair ─────────────────────────────────────────────────────────────
+
+def _closers(stack: list[str]) -> str:
+    return "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+
+def _close_truncated(text: str):
+    """
+    Parse JSON cut off mid-way: try cutting back to each of the last complete
+    elements (before a comma / after a closing bracket) and closing every
+    bracket still open there.
+    """
+    stack: list[str] = []
+    cuts: list[tuple[int, str]] = []
+    in_string = escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            cuts.append((i + 1, _closers(stack)))
+        elif c == ",":
+            cuts.append((i, _closers(stack)))
+    for end, closers in reversed(cuts[-_TRUNCATION_CANDIDATES:]):
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r"\1", text[:end]) + closers)
+        except ValueError:
+            continue
+    raise StructuredOutputError("unparseable JSON")
+
+
+def repair_json(raw: str) -> tuple[object, list[str]]:
+    """Parse model output as JSON, returning (value, repairs applied). Raises StructuredOutputError."""
+    repairs: list[str] = []
+    text = (raw or "").strip()
+    if "```" in text:
+        text = _FENCE.sub("", text).strip()
+        repairs.append("fences")
+    try:
+        return json.loads(text), repairs
+    except ValueError:
+        pass
+
+    # Drop prose before the first bracket and after the last one
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise StructuredOutputError("no JSON object or array in output")
+    start = min(starts)
+    end = max(text.rfind("}"), text.rfind("]"))
+    body = text[start : end + 1] if end > start else text[start:]
+    if body != text:
+        try:
+            return json.loads(body), repairs + ["extracted"]
+        except ValueError:
+            pass
+        if start > 0:
+            repairs.append("extracted")
+
+    cleaned = _TRAILING_COMMA.sub(r"\1", body)
+    if cleaned != body:
+        try:
+            return json.loads(cleaned), repairs + ["trailing_commas"]
+        except ValueError:
+            pass
+
+    # Truncated output: the text after the last bracket is part of the cut-off tail
+    return _close_truncated(text[start:]), repairs + ["truncated"]
+
+
+# ── Schema checks with salvage ───────────────────────────────────────────────
+
+def _salvage(items, spec) -> list:
+    if isinstance(spec, ItemSpec):
+        return [x for x in items if spec.valid(x)]
+    return [x for x in items if isinstance(x, spec)]
+
+
+def conform(data, schema: Schema) -> tuple[object, bool]:
+    """Fit parsed JSON to a schema. Returns (value, salvaged) or raises StructuredOutputError."""
+    if schema.item is not None:
+        if isinstance(data, dict):
+            wrapped = next((data[k] for k in schema.wrapper_keys if isinstance(data.get(k), list)), None)
+            if wrapped is None:
+                wrapped = next((v for v in data.values() if isinstance(v, list)), None)
+            data = wrapped
+        if not isinstance(data, list):
+            raise StructuredOutputError(f"{schema.name}: expected a JSON array")
+        items = _salvage(data, schema.item)
+        if len(items) < schema.min_items:
+            raise StructuredOutputError(f"{schema.name}: no valid items")
+        return items[: schema.max_items], len(items) < len(data)
+
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"{schema.name}: expected a JSON object")
+    salvaged = False
+    result = {k: v for k, v in data.items() if not schema.keys or k in schema.keys}
+    for key, spec in schema.lists.items():
+        values = data.get(key)
+        if not isinstance(values, list):
+            if schema.min_items:
+                raise StructuredOutputError(f"{schema.name}: missing list {key!r}")
+            # Optional list: drop a wrong-typed value (e.g. a prose string) rather than pass it on
+            if result.pop(key, None) is not None:
+                salvaged = True
+            continue
+        items = _salvage(values, spec)
+        if len(items) < schema.min_items:
+            raise StructuredOutputError(f"{schema.name}: no valid {key}")
+        salvaged = salvaged or len(items) < len(values)
+        result[key] = items[: schema.max_items]
+    return result, salvaged
+
+
+# ── Call-site API and metrics ────────────────────────────────────────────────
+
+_sites: dict[str, dict] = {}
+
+
+def _site(name: str) -> dict:
+    return _sites.setdefault(name, {
+        "calls": 0, "clean": 0, "repaired": 0, "salvaged": 0, "reprompted": 0, "failed": 0,
+        "repairs": {},
+    })
+
+
+def _parse(raw: str, schema: Schema) -> tuple[object, list[str], bool]:
+    data, repairs = repair_json(raw)
+    value, salvaged = conform(data, schema)
+    return value, repairs, salvaged
+
+
+def conforms(raw: str, schema: Schema) -> bool:
+    """Whether output repairs into the schema -- the response-cache gate for wx_structured."""
+    try:
+        _parse(raw, schema)
+        return True
+    except StructuredOutputError:
+        return False
+
+
+def _record(stats: dict, repairs: list[str], salvaged: bool) -> None:
+    """`repaired` counts every locally fixed output; `salvaged` is the subset that dropped items."""
+    if repairs or salvaged:
+        stats["repaired"] += 1
+        stats["salvaged"] += int(salvaged)
+        for name in repairs:
+            stats["repairs"][name] = stats["repairs"].get(name, 0) + 1
+    else:
+        stats["clean"] += 1
+
+
+def record_outcome(site: str, repairs: list[str], salvaged: bool = False, failed: bool = False) -> None:
+    """Count output parsed outside wx_structured (e.g. with repair_json + conform) under a call site."""
+    stats = _site(site)
+    stats["calls"] += 1
+    if failed:
+        stats["failed"] += 1
+    else:
+        _record(stats, repairs, salvaged)
+
+
+async def wx_structured(prompt: str, schema: Schema, site: str, max_tokens: int = 768,
+                        cache_ttl: float | None = None, regenerate: bool = False,
+                        reprompt: bool = True):
+    """
+    wx_json plus local repair and schema validation. Re-prompts once with the
+    unusable output if repair fails. Raises StructuredOutputError (with the
+    last output in .raw) if that fails too.
+    """
+    stats = _site(site)
+    stats["calls"] += 1
+    with llm_call_site(site):
+        raw = await wx_json(prompt, max_tokens=max_tokens, cache_ttl=cache_ttl, regenerate=regenerate,
+                            validate=lambda text: conforms(text, schema))
+    try:
+        value, repairs, salvaged = _parse(raw, schema)
+        _record(stats, repairs, salvaged)
+        return value
+    except StructuredOutputError as e:
+        if not reprompt:
+            stats["failed"] += 1
+            e.raw = raw
+            raise
+        error = e
+
+    stats["reprompted"] += 1
+    print(f"[structured] {site}: {error} -- re-prompting")
+    retry_prompt = (
+        f"{prompt}\n\nA previous answer to this request could not be used ({error}):\n"
+        f"{(raw or '')[:1500]}\n\nReturn ONLY the complete, corrected JSON."
+    )
+    with llm_call_site(site):
+        raw = await wx_json(retry_prompt, max_tokens=max_tokens)
+    try:
+        value, _, _ = _parse(raw, schema)
+        return value
+    except StructuredOutputError as e:
+        stats["failed"] += 1
+        e.raw = raw
+        raise
+
+
+def structured_stats() -> dict:
+    out = {}
+    for name, s in _sites.items():
+        calls = s["calls"]
+        out[name] = dict(
+            s,
+            repairs=dict(s["repairs"]),
+            repair_rate=round(s["repaired"] / calls, 3) if calls else 0.0,
+            reprompt_rate=round(s["reprompted"] / calls, 3) if calls else 0.0,
+            failure_rate=round(s["failed"] / calls, 3) if calls else 0.0,
+        )
+    return out
@@ -1,5 +1,8 @@
 import json
 import os
+from llm_usage import llm_call_site
+from response_cache import TTL_WEEK
+from structured_output import FLASHCARDS, wx_structured
 from watsonx_client import wx_json
 from dotenv import load_dotenv
 
@@ -55,10 +58,12 @@ def is_study_mode_active() -> bool:
     return _study_mode_active
 
 
-async def generate_anki_cards(page_text: str, subject: str = "") -> list[dict]:
+async def generate_anki_cards(page_text: str, subject: str = "", regenerate: bool = False) -> list[dict]:
     """
     Given raw page text, produce 5-8 Anki-style flashcards using GPT-4o.
     Each card: {"front": "question/term", "back": "answer/definition"}
+    Repeat requests for the same text are served from the response cache
+    unless regenerate=True.
     """
     try:
         subject_hint = f' The subject area appears to be: "{subject}".' if subject else ""
@@ -81,38 +86,29 @@ Rules:
 - focus on key concepts, not trivia
 - generate 5-8 cards total"""
 
-        raw = await wx_json(prompt, max_tokens=900)
-        # GPT json_object mode wraps in an object — handle both array and object
-        parsed = json.loads(raw)
-        if isinstance(parsed, list):
-            cards = parsed
-        elif isinstance(parsed, dict):
-            # Try common wrapper keys
-            for key in ("cards", "flashcards", "items", "data"):
-                if key in parsed and isinstance(parsed[key], list):
-                    cards = parsed[key]
-                    break
-            else:
-                # Attempt to extract any list value
-                for v in parsed.values():
-                    if isinstance(v, list):
-                        cards = v
-                        break
-                else:
-                    cards = []
-
-        # Validate structure
-        valid = [c for c in cards if isinstance(c, dict) and "front" in c and "back" in c]
-        return valid[:8]
+        # Wrapper keys ({"cards": [...]}), fences and truncation are handled by the
+        # structured-output layer; malformed cards are dropped, the rest kept
+        return await wx_structured(prompt, FLASHCARDS, "anki_cards", max_tokens=900,
+                                   cache_ttl=TTL_WEEK, regenerate=regenerate)
 
     except Exception as e:
         print(f"Anki card generation error: {e}")
         return []
 
 
-async def find_osu_study_resources(subject: str) -> list[dict]:
+def _parses(raw: str) -> bool:
+    """Cache gate for the resource suggestions: only JSON we can read back is stored."""
+    try:
+        json.loads(raw)
+        return True
+    except ValueError:
+        return False
+
+
+async def find_osu_study_resources(subject: str, regenerate: bool = False) -> list[dict]:
     """
     Return a mix of static OSU resources plus AI-generated subject-specific ones.
+    The AI suggestions for a subject are cached for a week unless regenerate=True.
     """
     resources = list(IBM_SKILLSBUILD_BASE)
 
@@ -131,7 +127,9 @@ Return ONLY a valid JSON array:
 
 If no IBM SkillsBuild course is a good match, return an empty array []"""
 
-        raw = await wx_json(prompt, max_tokens=400)
+        with llm_call_site("osu_resources"):
+            raw = await wx_json(prompt, max_tokens=400, cache_ttl=TTL_WEEK, regenerate=regenerate,
+                                validate=_parses)
         parsed = json.loads(raw)
         extras = []
         if isinstance(parsed, list):
@@ -0,0 +1,320 @@
+"""
+vector_index.py -- In-memory dense vector index for RAG retrieval.
+
+Embeddings are L2-normalized once on insert and kept in a single contiguous
+float32 matrix, so scoring a question is one matrix-vector product (a batch
+of questions, one matrix-matrix product) and top-k selection is an
+argpartition instead of a full sort. Each row has a payload
+dict (chunk text, title, ...) stored at the same position in `payloads`.
+
+Large indexes (multi-semester corpora) can additionally carry an IVF coarse
+quantizer: k-means centroids over the rows plus one inverted list per
+centroid. Queries then score only the rows in the `nprobe` closest lists
+(plus any rows added since the last build). The IVF structure is rebuilt
+on a background thread once the index grows past the last build by
+IVF_REBUILD_GROWTH; below IVF_MIN_ROWS search is always exact.
+
+Rows can be stored compactly: "float16" halves memory, "int8" quarters it
+using a per-row scale. Scoring decodes fixed-size blocks on the fly, so the
+full float32 matrix is never materialized.
+"""
+import os
+import threading
+
+import numpy as np
+
+IVF_MIN_ROWS = int(os.environ.get("RAG_IVF_MIN_ROWS", "20000"))
+IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", "8"))
+IVF_REBUILD_GROWTH = 1.5
+_KMEANS_ITERS = 10
+_KMEANS_SAMPLE_PER_LIST = 64
+_BLOCK_ROWS = 8192
+VECTOR_DTYPE = os.environ.get("RAG_VECTOR_DTYPE", "float32")
+_STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a row-wise L2-normalized copy. Zero rows stay zero (score 0)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k largest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _decoder(stored: np.ndarray, scales: np.ndarray | None):
+    """Return rows(selector) -> float32 rows for a (possibly quantized) matrix."""
+    def rows(selector) -> np.ndarray:
+        block = stored[selector].astype(np.float32)
+        if scales is not None:
+            block *= scales[selector][:, None]
+        return block
+    return rows
+
+
+def _assign(rows, size: int, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) for each row, decoded in blocks to bound memory."""
+    out = np.empty(size, dtype=np.int32)
+    for start in range(0, size, _BLOCK_ROWS):
+        stop = min(start + _BLOCK_ROWS, size)
+        out[start:stop] = np.argmax(rows(slice(start, stop)) @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(rows: np.ndarray, k: int, iters: int = _KMEANS_ITERS, seed: int = 0) -> np.ndarray:
+    """k-means on unit vectors with cosine assignment; returns normalized (k, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = rows[rng.choice(len(rows), size=k, replace=False)].copy()
+    decode = _decoder(rows, None)
+    for _ in range(iters):
+        labels = _assign(decode, len(rows), centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, rows)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random rows so every list stays useful
+            sums[empty] = rows[rng.choice(len(rows), size=int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file coarse quantizer over `size` rows served by a decoder."""
+
+    def __init__(self, rows, size: int, nlist: int | None = None, seed: int = 0):
+        self.size = size
+        self.nlist = nlist or max(1, int(round(np.sqrt(self.size))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(self.size, self.nlist * _KMEANS_SAMPLE_PER_LIST)
+        sample = rows(np.sort(rng.choice(self.size, size=sample_size, replace=False)))
+        self.centroids = spherical_kmeans(sample, self.nlist, seed=seed)
+        labels = _assign(rows, self.size, self.centroids)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[i] : bounds[i + 1]] for i in range(self.nlist)]
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row ids in the nprobe lists whose centroids are closest to q."""
+        probe = _top_k(self.centroids @ q, min(nprobe, self.nlist))
+        return np.concatenate([self.lists[i] for i in probe])
+
+
+class VectorIndex:
+    """
+    Append-only cosine-similarity index over pre-normalized embeddings.
+
+    Row ids are insertion positions; they stay stable until clear().
+    """
+
+    def __init__(self, dim: int | None = None, initial_capacity: int = 256,
+                 ivf_min_rows: int = IVF_MIN_ROWS, nprobe: int = IVF_NPROBE,
+                 dtype: str = VECTOR_DTYPE):
+        if dtype not in _STORAGE_DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(_STORAGE_DTYPES)}, got {dtype!r}")
+        self.dim = dim
+        self.dtype = dtype
+        self.payloads: list[dict] = []
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._initial_capacity = initial_capacity
+        self._matrix: np.ndarray | None = None
+        # Per-row dequantization scales (int8 storage only)
+        self._scales: np.ndarray | None = None
+        self._size = 0
+        self._ivf: IVFIndex | None = None
+        self._ivf_building = False
+        # Bumped by clear() so a background build of stale rows is discarded
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """View of the populated rows in their stored (possibly quantized) dtype."""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=_STORAGE_DTYPES[self.dtype])
+        return self._matrix[: self._size]
+
+    def _rows(self):
+        """Decoder over a stable snapshot of the populated rows."""
+        scales = self._scales[: self._size] if self._scales is not None else None
+        return _decoder(self.matrix, scales)
+
+    def dense(self, rows=None) -> np.ndarray:
+        """Decode rows (all by default) back to normalized float32."""
+        return self._rows()(slice(None) if rows is None else rows)
+
+    def _score(self, q: np.ndarray, rows=None) -> np.ndarray:
+        """
+        Cosine scores for the given row ids (or all rows), decoding in blocks.
+        q is one (dim,) query or a (dim, n_queries) matrix of them.
+        """
+        if self.dtype == "float32":
+            return (self.matrix if rows is None else self._matrix[rows]) @ q
+        decode = self._rows()
+        count = self._size if rows is None else len(rows)
+        scores = np.empty((count,) + q.shape[1:], dtype=np.float32)
+        for start in range(0, count, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, count)
+            selector = slice(start, stop) if rows is None else rows[start:stop]
+            scores[start:stop] = decode(selector) @ q
+        return scores
+
+    def _reserve(self, extra: int) -> None:
+        """Grow the backing matrix geometrically so appends stay amortized O(1)."""
+        needed = self._size + extra
+        if self._matrix is not None and needed <= self._matrix.shape[0]:
+            return
+        capacity = max(self._initial_capacity, needed, 2 * (self._matrix.shape[0] if self._matrix is not None else 0))
+        grown = np.empty((capacity, self.dim), dtype=_STORAGE_DTYPES[self.dtype])
+        if self._matrix is not None:
+            grown[: self._size] = self._matrix[: self._size]
+        self._matrix = grown
+        if self.dtype == "int8":
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[: self._size] = self._scales[: self._size]
+            self._scales = scales
+
+    def add(self, embeddings, payloads: list[dict]) -> list[int]:
+        """Normalize and append embeddings with their payloads. Returns the new row ids."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if len(vectors) != len(payloads):
+            raise ValueError("embeddings and payloads must have the same length")
+        if len(vectors) == 0:
+            return []
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-dim embeddings, got {vectors.shape[1]}")
+
+        self._reserve(len(vectors))
+        start = self._size
+        stop = start + len(vectors)
+        unit = _normalize_rows(vectors)
+        if self.dtype == "int8":
+            # Symmetric per-row quantization: row ~= int8_row * scale
+            scale = np.abs(unit).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            self._matrix[start:stop] = np.round(unit / scale[:, None]).astype(np.int8)
+            self._scales[start:stop] = scale
+        else:
+            self._matrix[start:stop] = unit
+        self._size = stop
+        self.payloads.extend(payloads)
+        self._maybe_rebuild_ivf()
+        return list(range(start, self._size))
+
+    def _maybe_rebuild_ivf(self) -> None:
+        """Start a background IVF build once the index is big enough or has grown enough."""
+        if self._ivf_building or self._size < self.ivf_min_rows:
+            return
+        if self._ivf is not None and self._size < self._ivf.size * IVF_REBUILD_GROWTH:
+            return
+        self._ivf_building = True
+        # Rows are append-only, so this view stays valid even if the matrix is regrown
+        snapshot, size, generation = self._rows(), self._size, self._generation
+
+        def _build():
+            try:
+                ivf = IVFIndex(snapshot, size)
+                if generation == self._generation:
+                    self._ivf = ivf
+            except Exception as e:
+                print(f"[VectorIndex] IVF build failed: {e}")
+            finally:
+                self._ivf_building = False
+            # Rows may have landed while building; catch up if they crossed the threshold
+            if generation == self._generation:
+                self._maybe_rebuild_ivf()
+
+        threading.Thread(target=_build, name="ivf-rebuild", daemon=True).start()
+
+    def build_ivf(self, nlist: int | None = None) -> None:
+        """Synchronously (re)build the IVF structure over the current rows."""
+        if self._size:
+            self._ivf = IVFIndex(self._rows(), self._size, nlist)
+
+    def search(self, query, top_k: int = 5, nprobe: int | None = None,
+               exact: bool = False, rows: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """
+        Return up to top_k (row_id, cosine_similarity) pairs, best first.
+
+        Uses the IVF lists when one is built and the index is past
+        ivf_min_rows, unless exact=True. `rows` restricts scoring to those
+        row ids (e.g. a metadata filter), which is always exact.
+        """
+        q = np.asarray(query, dtype=np.float32)
+        return self.search_many(q[None, :], top_k, nprobe, exact, rows)[0]
+
+    def search_many(self, queries, top_k: int = 5, nprobe: int | None = None,
+                    exact: bool = False, rows: np.ndarray | None = None) -> list[list[tuple[int, float]]]:
+        """
+        search() for several queries at once: one result list per query row.
+
+        All queries are scored against one candidate set with a single
+        matrix-matrix product. With IVF, the candidates are the union of
+        every query's probed lists.
+        """
+        q = np.asarray(queries, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        if self._size == 0 or top_k <= 0 or len(q) == 0:
+            return [[] for _ in range(len(q))]
+        norms = np.linalg.norm(q, axis=1)
+        live = norms > 0
+        if not live.any():
+            return [[] for _ in range(len(q))]
+        q = _normalize_rows(q)
+
+        ivf = self._ivf
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        elif not exact and ivf is not None and self._size >= self.ivf_min_rows:
+            # Probed lists plus the tail added since the build, which no list covers yet
+            probed = [ivf.candidates(qi, nprobe or self.nprobe) for qi in q[live]]
+            if ivf.size < self._size:
+                probed.append(np.arange(ivf.size, self._size))
+            rows = np.unique(np.concatenate(probed))
+
+        scores = self._score(q.T, rows)
+        results = []
+        for j in range(len(q)):
+            if not live[j]:
+                results.append([])
+                continue
+            column = np.ascontiguousarray(scores[:, j])
+            top = _top_k(column, top_k)
+            ids = top if rows is None else rows[top]
+            results.append([(int(i), float(column[t])) for i, t in zip(ids, top)])
+        return results
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size: allocated matrix plus payload text."""
+        matrix = self._matrix.nbytes if self._matrix is not None else 0
+        if self._scales is not None:
+            matrix += self._scales.nbytes
+        return matrix + sum(len(p.get("text", "")) for p in self.payloads)
+
+    def clear(self) -> None:
+        """Drop all rows (keeps the instance so existing references stay valid)."""
+        self.payloads = []
+        self._matrix = None
+        self._scales = None
+        self._size = 0
+        self._ivf = None
+        self._generation += 1
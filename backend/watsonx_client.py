@@ -8,11 +8,34 @@ Required env vars:
   IBM_WATSONX_API_KEY    -- IAM API key from cloud.ibm.com
   IBM_WATSONX_PROJECT_ID -- from dataplatform.cloud.ibm.com, Manage > General
   IBM_WATSONX_URL        -- e.g. https://us-south.ml.cloud.ibm.com (default)
+
+All IBM calls (IAM, text generation, Orchestrate) share one pooled
+keep-alive client per event loop, so repeated Granite calls reuse warm
+TCP+TLS connections (multiplexed over HTTP/2 when `h2` is installed).
+Pool sizing is tunable:
+  WATSONX_HTTP_MAX_CONNECTIONS  -- total sockets (default 20)
+  WATSONX_HTTP_MAX_KEEPALIVE    -- idle sockets kept open (default 10)
+  WATSONX_HTTP_KEEPALIVE_EXPIRY -- seconds an idle socket is kept (default 60)
+  WATSONX_HTTP2                 -- "0" to force HTTP/1.1
+Generations are retried on 429 / transient 5xx by llm_resilience;
+WATSONX_HEDGE=1 also hedges slow ones.
 """
+import asyncio
+import json
 import os
+import weakref
+from contextlib import AsyncExitStack, aclosing
+from typing import AsyncIterator, Callable
+
 import httpx
 from datetime import datetime, timezone
 
+from llm_resilience import get_endpoint
+from llm_scheduler import get_scheduler
+from llm_usage import track_call
+from response_cache import ResponseCache, cache_key
+from single_flight import coalesce, request_key
+
 _WX_URL = os.environ.get("IBM_WATSONX_URL", "https://us-south.ml.cloud.ibm.com")
 _WX_PROJECT_ID = os.environ.get("IBM_WATSONX_PROJECT_ID", "")
 _WX_API_KEY = os.environ.get("IBM_WATSONX_API_KEY", "")
@@ -22,41 +45,153 @@ MODEL_ID = "ibm/granite-3-3-8b-instruct"
 
 _iam_token: str = ""
 _iam_expires: float = 0.0
+# In-flight IAM fetch per event loop, shared by every caller that finds the token stale
+_iam_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
+# Background refresh renews this many seconds before expiry (IAM tokens last ~1h)
+IAM_REFRESH_MARGIN = float(os.environ.get("WATSONX_IAM_REFRESH_MARGIN", "300"))
+IAM_RETRY_DELAY = 30.0
+_refresher: asyncio.Task | None = None
 
+HTTP_MAX_CONNECTIONS = int(os.environ.get("WATSONX_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("WATSONX_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("WATSONX_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2 = os.environ.get("WATSONX_HTTP2", "1") != "0"
+# Send a duplicate generation when one runs past the observed p95 latency (doubles cost on slow calls)
+WATSONX_HEDGE = os.environ.get("WATSONX_HEDGE", "0") == "1"
 
-async def _get_iam_token() -> str:
-    """Fetch (and cache) an IBM Cloud IAM bearer token."""
-    global _iam_token, _iam_expires
-    now = datetime.now(timezone.utc).timestamp()
-    if _iam_token and now < _iam_expires - 60:
-        return _iam_token
-    async with httpx.AsyncClient(timeout=20) as c:
-        r = await c.post(
-            "https://iam.cloud.ibm.com/identity/token",
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            data={
-                "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-                "apikey": _WX_API_KEY,
-            },
+# One client per event loop: the sync LangChain wrapper runs calls on its own
+# short-lived loop, and an httpx pool cannot be shared across loops.
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (installed by httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the pooled client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        http2 = _http2_available()
+        client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(120, connect=10),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
         )
-        r.raise_for_status()
-        d = r.json()
-        _iam_token = d["access_token"]
-        _iam_expires = now + d.get("expires_in", 3600)
+        _http_clients[loop] = client
+        print(f"[watsonx] Opened pooled HTTP client ({'HTTP/2' if http2 else 'HTTP/1.1'}, "
+              f"max {HTTP_MAX_CONNECTIONS} connections)")
+    return client
+
+
+async def close_http_client() -> None:
+    """Close the running loop's pooled client (FastAPI lifespan shutdown)."""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def _now() -> float:
+    return datetime.now(timezone.utc).timestamp()
+
+
+async def _fetch_iam_token() -> str:
+    """POST to IAM and store the new token. Only ever run via _get_iam_token's single flight."""
+    global _iam_token, _iam_expires
+    requested_at = _now()
+    r = await get_http_client().post(
+        "https://iam.cloud.ibm.com/identity/token",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data={
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": _WX_API_KEY,
+        },
+        timeout=20,
+    )
+    r.raise_for_status()
+    d = r.json()
+    _iam_token = d["access_token"]
+    _iam_expires = requested_at + d.get("expires_in", 3600)
     return _iam_token
 
 
-async def _generate(
-    prompt: str,
-    max_new_tokens: int = 1024,
-    temperature: float = 0.3,
-) -> str:
-    """Call the watsonx.ai text/generation endpoint and return generated text."""
+async def _get_iam_token(force: bool = False) -> str:
+    """
+    Fetch (and cache) an IBM Cloud IAM bearer token.
+
+    Refresh is single-flight: callers that find the token stale at the same
+    time (e.g. the gathered cards / resources / study-plan calls) all await
+    one IAM request instead of each firing their own.
+    """
+    if not force and _iam_token and _now() < _iam_expires - 60:
+        return _iam_token
+    loop = asyncio.get_running_loop()
+    task = _iam_inflight.get(loop)
+    if task is None or task.done():
+        task = loop.create_task(_fetch_iam_token())
+        _iam_inflight[loop] = task
+    # Shielded so one cancelled caller does not abort the fetch the others are awaiting
+    return await asyncio.shield(task)
+
+
+async def _refresh_iam_token_forever() -> None:
+    """Renew the token IAM_REFRESH_MARGIN seconds before expiry so requests never wait on IAM."""
+    while True:
+        delay = _iam_expires - IAM_REFRESH_MARGIN - _now() if _iam_token else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await _get_iam_token(force=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[watsonx] Background IAM refresh failed: {e} -- retrying in {IAM_RETRY_DELAY:.0f}s")
+            await asyncio.sleep(IAM_RETRY_DELAY)
+
+
+def start_token_refresher() -> asyncio.Task | None:
+    """Start the background IAM refresher on the running loop (no-op without an API key)."""
+    global _refresher
+    if not _WX_API_KEY:
+        return None
+    if _refresher is None or _refresher.done():
+        _refresher = asyncio.get_running_loop().create_task(_refresh_iam_token_forever())
+    return _refresher
+
+
+async def stop_token_refresher() -> None:
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except asyncio.CancelledError:
+            pass
+        _refresher = None
+
+
+async def _request(prompt: str, max_new_tokens: int, temperature: float) -> tuple[dict, dict]:
+    """Auth headers and JSON body shared by the plain and streaming generation calls."""
     if not _WX_API_KEY or not _WX_PROJECT_ID:
         raise RuntimeError(
             "IBM_WATSONX_API_KEY and IBM_WATSONX_PROJECT_ID must be set in .env"
         )
     token = await _get_iam_token()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
     payload = {
         "model_id": MODEL_ID,
         "project_id": _WX_PROJECT_ID,
@@ -67,18 +202,155 @@ async def _generate(
             "repetition_penalty": 1.05,
         },
     }
-    async with httpx.AsyncClient(timeout=120) as c:
-        r = await c.post(
-            f"{_WX_URL}/ml/v1/text/generation?version=2023-05-29",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-            },
-            json=payload,
-        )
-        r.raise_for_status()
-        return r.json()["results"][0]["generated_text"].strip()
+    return headers, payload
+
+
+_response_cache: ResponseCache | None = None
+
+
+def _get_response_cache() -> ResponseCache:
+    """Lazily open the persistent response cache (llm_cache.db)."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+def response_cache_stats() -> dict:
+    return _get_response_cache().stats()
+
+
+def _usable(text: str, validate: Callable[[str], bool] | None) -> bool:
+    if validate is None:
+        return True
+    try:
+        return bool(validate(text))
+    except Exception:
+        return False
+
+
+async def _generate(
+    prompt: str,
+    max_new_tokens: int = 1024,
+    temperature: float = 0.3,
+    cache_ttl: float | None = None,
+    regenerate: bool = False,
+    validate: Callable[[str], bool] | None = None,
+) -> str:
+    """
+    Call the watsonx.ai text/generation endpoint and return generated text.
+
+    With cache_ttl (seconds), an identical earlier generation is returned
+    from the persistent response cache. regenerate=True skips the lookup
+    but still stores the fresh result. validate(text) gates the cache: only
+    output it accepts is stored, and a cached entry it rejects is deleted
+    and regenerated.
+    """
+    if cache_ttl:
+        key = cache_key(MODEL_ID, prompt, {"max_new_tokens": max_new_tokens, "temperature": temperature})
+        if not regenerate:
+            try:
+                cached = _get_response_cache().get(key)
+                if cached is not None:
+                    if _usable(cached, validate):
+                        return cached
+                    _get_response_cache().invalidate(key)
+            except Exception as e:
+                print(f"[watsonx] Response cache read failed: {e}")
+        text = await _generate(prompt, max_new_tokens, temperature)
+        if _usable(text, validate):
+            try:
+                _get_response_cache().put(key, MODEL_ID, text, cache_ttl)
+            except Exception as e:
+                print(f"[watsonx] Response cache write failed: {e}")
+        return text
+
+    async def _upstream() -> str:
+        headers, payload = await _request(prompt, max_new_tokens, temperature)
+
+        async def _attempt() -> str:
+            async with get_scheduler("watsonx").slot() as queued:
+                with track_call("watsonx", MODEL_ID, queued) as call:
+                    r = await get_http_client().post(
+                        f"{_WX_URL}/ml/v1/text/generation?version=2023-05-29",
+                        headers={**headers, "Accept": "application/json"},
+                        json=payload,
+                        timeout=120,
+                    )
+                    r.raise_for_status()
+                    result = r.json()["results"][0]
+                    call.tokens(result.get("input_token_count"), result.get("generated_token_count"))
+            return result["generated_text"].strip()
+
+        # 429s and transient 5xx are retried with backoff (see llm_resilience)
+        return await get_endpoint("watsonx.generation", hedge=WATSONX_HEDGE).call(_attempt)
+
+    # Byte-identical prompts already in flight share that one upstream call
+    key = request_key(MODEL_ID, prompt, max_new_tokens, temperature)
+    return await coalesce("watsonx.generation", key, _upstream)
+
+
+async def _generate_stream(
+    prompt: str,
+    max_new_tokens: int = 1024,
+    temperature: float = 0.3,
+) -> AsyncIterator[str]:
+    """
+    Call the text/generation_stream endpoint (server-sent events) and yield
+    text deltas as they arrive. Leading whitespace is dropped, matching _generate.
+
+    Opening the stream, up to its first event, goes through the resilience
+    layer, so a 429 / transient 5xx is retried before anything reaches the
+    caller. Once text has been yielded, errors propagate as-is.
+    """
+    headers, payload = await _request(prompt, max_new_tokens, temperature)
+
+    async def _open():
+        async with AsyncExitStack() as stack:
+            queued = await stack.enter_async_context(get_scheduler("watsonx").slot())
+            call = stack.enter_context(track_call("watsonx", MODEL_ID, queued))
+            r = await stack.enter_async_context(get_http_client().stream(
+                "POST",
+                f"{_WX_URL}/ml/v1/text/generation_stream?version=2023-05-29",
+                headers={**headers, "Accept": "text/event-stream"},
+                json=payload,
+                timeout=120,
+            ))
+            if r.is_error:
+                await r.aread()
+                r.raise_for_status()
+            lines = r.aiter_lines()
+            first = None
+            async for line in lines:
+                if line.startswith("data:"):
+                    first = line
+                    break
+            # Hand the open slot, call record and response to the caller
+            return stack.pop_all(), call, lines, first
+
+    # Own endpoint: time-to-first-event samples would drag down the p95 that
+    # hedges full generations. No hedging: a losing duplicate stream could be left open
+    stack, call, lines, line = await get_endpoint("watsonx.generation_stream").call(_open, hedge=False)
+    started = False
+    async with stack:
+        while line is not None:
+            if line.startswith("data:"):
+                try:
+                    event = json.loads(line[5:])
+                except ValueError:
+                    event = {}
+                for result in event.get("results", []):
+                    # Token counts are cumulative; the last event carries the totals
+                    if "generated_token_count" in result:
+                        call.tokens(result.get("input_token_count") or call.prompt_tokens,
+                                    result["generated_token_count"])
+                    text = result.get("generated_text") or ""
+                    if not started:
+                        text = text.lstrip()
+                        started = bool(text)
+                    if text:
+                        yield text
+            line = await anext(lines, None)
 
 
 def _build_chat_prompt(system: str, user: str) -> str:
@@ -93,26 +365,46 @@ def _build_chat_prompt(system: str, user: str) -> str:
 
 # -- Public API ----------------------------------------------------------------
 
-async def wx_chat(prompt: str, system: str = "", max_tokens: int = 1024) -> str:
+async def wx_chat(prompt: str, system: str = "", max_tokens: int = 1024,
+                  cache_ttl: float | None = None, regenerate: bool = False,
+                  validate: Callable[[str], bool] | None = None) -> str:
     """
     General-purpose async chat. Returns the model reply as a plain string.
-    Powered by IBM Granite via watsonx.ai.
+    Powered by IBM Granite via watsonx.ai. cache_ttl / regenerate / validate: see _generate.
+    """
+    full_prompt = _build_chat_prompt(system, prompt) if system else prompt
+    return await _generate(full_prompt, max_new_tokens=max_tokens, temperature=0.35,
+                           cache_ttl=cache_ttl, regenerate=regenerate, validate=validate)
+
+
+async def wx_chat_stream(prompt: str, system: str = "", max_tokens: int = 1024) -> AsyncIterator[str]:
+    """
+    Streaming variant of wx_chat: an async iterator of reply text deltas,
+    so callers can show the first tokens while Granite is still generating.
     """
     full_prompt = _build_chat_prompt(system, prompt) if system else prompt
-    return await _generate(full_prompt, max_new_tokens=max_tokens, temperature=0.35)
+    # aclosing: a caller that stops early releases the scheduler slot and connection right away
+    async with aclosing(_generate_stream(full_prompt, max_new_tokens=max_tokens, temperature=0.35)) as deltas:
+        async for delta in deltas:
+            yield delta
 
 
-async def wx_json(prompt: str, max_tokens: int = 768) -> str:
+async def wx_json(prompt: str, max_tokens: int = 768,
+                  cache_ttl: float | None = None, regenerate: bool = False,
+                  validate: Callable[[str], bool] | None = None) -> str:
     """
     JSON-focused generation (low temperature). Returns raw text -- caller
     must parse with json.loads(). Powered by IBM granite via watsonx.ai.
+    Pass cache_ttl to reuse an identical earlier generation, with validate
+    so only text the caller can parse is cached (see _generate).
     """
     system = (
         "You are a precise AI assistant. Always respond with valid JSON only. "
         "Do not include any explanation, markdown, or text outside the JSON."
     )
     full_prompt = _build_chat_prompt(system, prompt)
-    return await _generate(full_prompt, max_new_tokens=max_tokens, temperature=0.1)
+    return await _generate(full_prompt, max_new_tokens=max_tokens, temperature=0.1,
+                           cache_ttl=cache_ttl, regenerate=regenerate, validate=validate)
 
 
 async def test_connection() -> dict:
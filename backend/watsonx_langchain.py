@@ -15,9 +15,16 @@ from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import BaseMessage, AIMessage
 from langchain_core.outputs import ChatGeneration, ChatResult
 
+from llm_usage import llm_call_site
 from watsonx_client import wx_chat
 
 
+async def _chat(user: str, system: str, max_tokens: int) -> str:
+    # Labelled inside the coroutine so the sync path's fresh loop/thread gets it too
+    with llm_call_site("langchain_agent"):
+        return await wx_chat(user, system=system, max_tokens=max_tokens)
+
+
 def _msgs_to_prompt(messages: Sequence[BaseMessage]) -> tuple[str, str]:
     """Convert a LangChain message list into (system, user) string pair."""
     system_parts: list[str] = []
@@ -70,12 +77,12 @@ class WatsonxChat(BaseChatModel):
                 # so fall back to thread pool
                 import concurrent.futures
                 with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-                    future = ex.submit(asyncio.run, wx_chat(user, system=system, max_tokens=self.max_tokens))
+                    future = ex.submit(asyncio.run, _chat(user, system, self.max_tokens))
                     text = future.result(timeout=120)
             else:
-                text = loop.run_until_complete(wx_chat(user, system=system, max_tokens=self.max_tokens))
+                text = loop.run_until_complete(_chat(user, system, self.max_tokens))
         except RuntimeError:
-            text = asyncio.run(wx_chat(user, system=system, max_tokens=self.max_tokens))
+            text = asyncio.run(_chat(user, system, self.max_tokens))
 
         message = AIMessage(content=text)
         generation = ChatGeneration(message=message)
@@ -89,7 +96,7 @@ class WatsonxChat(BaseChatModel):
         **kwargs: Any,
     ) -> ChatResult:
         system, user = _msgs_to_prompt(messages)
-        text = await wx_chat(user, system=system, max_tokens=self.max_tokens)
+        text = await _chat(user, system, self.max_tokens)
         message = AIMessage(content=text)
         generation = ChatGeneration(message=message)
         return ChatResult(generations=[generation])
@@ -297,7 +297,7 @@ function App() {
   const [studyData, setStudyData] = useState<StudyData | null>(null);
   const [quizData, setQuizData] = useState<any>(null);
   const [studyResults, setStudyResults] = useState<StudyResultsData | null>(null);
-  const [qaMessages, setQaMessages] = useState<{ role: 'user' | 'agent'; text: string }[]>([]);
+  const [qaMessages, setQaMessages] = useState<{ role: 'user' | 'agent'; text: string; streamId?: string }[]>([]);
 
   // ── Study mode state ──
   const [ankiCards, setAnkiCards] = useState<{ front: string; back: string }[]>([]);
@@ -470,7 +470,18 @@ function App() {
             });
           }
           else if (d.type === 'study_qa_response') {
-            setQaMessages(p => [...p, { role: 'agent', text: d.text }]);
+            if (d.stream_id) {
+              // Streamed answer: append deltas to one bubble; the done frame carries the full text
+              setQaMessages(p => {
+                const i = p.findIndex(m => m.streamId === d.stream_id);
+                if (i === -1) return [...p, { role: 'agent', text: d.done ? d.text : d.delta, streamId: d.stream_id }];
+                const next = [...p];
+                next[i] = { ...next[i], text: d.done ? d.text : next[i].text + d.delta };
+                return next;
+              });
+            } else {
+              setQaMessages(p => [...p, { role: 'agent', text: d.text }]);
+            }
           }
           else if (d.type === 'study_mode_active') {
             setMode('study_mode');